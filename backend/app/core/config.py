@@ -42,6 +42,17 @@ class Settings(BaseSettings):
     # Brave Search settings
     BRAVE_API_KEY: str = os.getenv("BRAVE_API_KEY", "")
 
+    # Per-provider search timeout in seconds (primary provider falls back to DuckDuckGo on timeout)
+    SEARCH_PROVIDER_TIMEOUT: float = float(os.getenv("SEARCH_PROVIDER_TIMEOUT", "5.0"))
+
+    # Search result cache settings
+    SEARCH_CACHE_TTL: int = int(os.getenv("SEARCH_CACHE_TTL", "300"))  # Seconds
+    SEARCH_CACHE_MAXSIZE: int = int(os.getenv("SEARCH_CACHE_MAXSIZE", "1024"))
+
+    # Redis cache settings (shared search cache tier, disabled when empty)
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+    REDIS_CACHE_TTL: int = int(os.getenv("REDIS_CACHE_TTL", "3600"))  # Seconds
+
     # Security settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
@@ -1,11 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.openapi.utils import get_openapi
+from contextlib import asynccontextmanager
 import logging
 import sys
 
 from app.api.routes import router as api_router
 from app.core.config import settings
+from app.services.search_service import close_http_client
+from app.services.cache_service import close_redis_cache
 
 # 로깅 설정
 logging.basicConfig(
@@ -23,9 +27,18 @@ logging.getLogger("asyncio").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 공유 HTTP 클라이언트 및 Redis 연결 종료
+    await close_http_client()
+    await close_redis_cache()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse,  # orjson로 응답 직렬화
+    lifespan=lifespan
 )
 
 # Set up CORS
@@ -0,0 +1,60 @@
+from typing import Optional
+import logging
+from redis import asyncio as aioredis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache:
+    """
+    Async Redis wrapper used as a cache tier shared across workers and restarts
+    """
+    def __init__(self, url: str):
+        self.client = aioredis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Return the cached bytes for a key, or None on a miss or Redis error
+        """
+        try:
+            return await self.client.get(key)
+        except Exception as e:
+            logger.error("Error reading from Redis cache: %s", e)
+            return None
+
+    async def setex(self, key: str, ttl: int, value: bytes) -> None:
+        """
+        Store bytes under a key with an expiry in seconds
+        """
+        try:
+            await self.client.setex(key, ttl, value)
+        except Exception as e:
+            logger.error("Error writing to Redis cache: %s", e)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_redis_cache: Optional[RedisCache] = None
+
+
+def get_redis_cache() -> Optional[RedisCache]:
+    """
+    Return the shared RedisCache, or None when REDIS_URL is not configured
+    """
+    global _redis_cache
+    if _redis_cache is None and settings.REDIS_URL:
+        _redis_cache = RedisCache(settings.REDIS_URL)
+    return _redis_cache
+
+
+async def close_redis_cache() -> None:
+    """
+    Close the shared Redis connection pool (called on application shutdown)
+    """
+    global _redis_cache
+    if _redis_cache is not None:
+        await _redis_cache.aclose()
+        _redis_cache = None
@@ -1,473 +1,569 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable
 import httpx
+import asyncio
 import logging
-import json
-import urllib.parse
+import orjson
+import hashlib
+import re
+from itertools import islice
+from cachetools import TTLCache
+from selectolax.lexbor import LexborHTMLParser, LexborNode
 from app.core.config import settings
-from app.models.schemas import SearchResult
+from app.services.cache_service import get_redis_cache
 
 logger = logging.getLogger(__name__)
 
+
+# Hangul Jamo, Compatibility Jamo and Syllables, matched in one compiled scan
+_HANGUL_PATTERN = re.compile("[\u1100-\u11FF\u3131-\u318F\uAC00-\uD7A3]")
+
+# Browser-like headers for DuckDuckGo HTML scraping (Korean language preference)
+_DDG_HTML_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7"
+}
+
+
+def _loads(response: httpx.Response) -> Any:
+    """
+    Decode a JSON response body with orjson straight from the raw bytes
+    """
+    return orjson.loads(response.content)
+
+
+def _extract_ddg_html_results(
+    nodes: List[LexborNode],
+    title_selector: str,
+    snippet_selector: str,
+    default_snippet: str
+) -> List[Dict[str, Any]]:
+    """
+    Build search results from DuckDuckGo HTML result nodes
+    """
+    results = []
+    for i, node in enumerate(nodes):
+        title_node = node.css_first(title_selector)
+        if title_node is None:
+            logger.warning("Could not extract title or link from result block %s", i+1)
+            continue
+
+        title = title_node.text().strip()
+        link = (title_node.attributes.get("href") or "").strip()
+
+        snippet_node = node.css_first(snippet_selector)
+        snippet = snippet_node.text().strip() if snippet_node is not None else default_snippet
+
+        if title and link:
+            results.append({
+                "title": title,
+                "link": link,
+                "snippet": snippet
+            })
+            logger.debug("Extracted result %s: Title: %s...", i+1, title[:30])
+        else:
+            logger.warning("Could not extract title or link from result block %s", i+1)
+
+    return results
+
+
+def _make_extractor(title_key: str, link_key: str, snippet_key: str) -> Callable[..., List[Dict[str, Any]]]:
+    """
+    Build a function that maps a provider's result items to title/link/snippet dicts
+    """
+    def extract(items: Optional[Iterable[Dict[str, Any]]], num_results: int) -> List[Dict[str, Any]]:
+        return [
+            {
+                "title": item.get(title_key) or "",
+                "link": item.get(link_key) or "",
+                "snippet": item.get(snippet_key) or ""
+            }
+            for item in islice(items or (), num_results)
+        ]
+    return extract
+
+
+# Per-provider field extractors, built once with each API's key names
+_extract_google = _make_extractor("title", "link", "snippet")
+_extract_searxng = _make_extractor("title", "url", "content")
+_extract_tavily = _make_extractor("title", "url", "content")
+_extract_serper = _make_extractor("title", "link", "snippet")
+_extract_brave = _make_extractor("title", "url", "description")
+
+
+# In-process LRU + TTL cache of search results keyed on (provider, query, num_results)
+_search_cache: TTLCache = TTLCache(maxsize=settings.SEARCH_CACHE_MAXSIZE, ttl=settings.SEARCH_CACHE_TTL)
+
+# Searches currently in flight, so concurrent identical queries share one upstream call
+_inflight_searches: Dict[Tuple[str, str, int], asyncio.Future] = {}
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    """
+    Retrieve a finished future's exception so asyncio does not log it as never retrieved
+    """
+    if not future.cancelled():
+        future.exception()
+
+
+# Shared HTTP client so provider calls reuse pooled keep-alive connections
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide AsyncClient, creating it on first use
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # HTTP/2 is negotiated per host via ALPN, so Google/Brave/Tavily/Serper
+        # requests multiplex over one connection while others stay on HTTP/1.1
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            retries=1  # Retry once on connection errors (e.g. stale pooled sockets)
+        )
+        timeout = httpx.Timeout(connect=1.0, read=settings.SEARCH_PROVIDER_TIMEOUT, write=1.0, pool=1.0)
+        _http_client = httpx.AsyncClient(transport=transport, timeout=timeout)
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """
+    Close the shared AsyncClient (called on application shutdown)
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 class SearchService:
     def __init__(self):
         self.search_provider = settings.SEARCH_PROVIDER
+        self.client = get_http_client()
 
         # Google Search settings
         self.google_api_key = settings.GOOGLE_SEARCH_API_KEY
         self.google_search_engine_id = settings.GOOGLE_SEARCH_ENGINE_ID
         self.google_search_url = "https://www.googleapis.com/customsearch/v1"
+        self.google_base_params = {
+            "key": self.google_api_key,
+            "cx": self.google_search_engine_id,
+            "fields": "items(title,link,snippet)"  # Partial response: only the fields we read
+        }
 
         # SearXNG settings
         self.searxng_url = settings.SEARXNG_URL
+        self.searxng_search_url = f"{self.searxng_url}/search"
+        self.searxng_base_params = {
+            "format": "json",
+            "categories": "general",
+            "language": "en-US"
+        }
 
         # Tavily settings
         self.tavily_api_key = settings.TAVILY_API_KEY
         self.tavily_search_url = "https://api.tavily.com/search"
+        self.tavily_headers = {
+            "Content-Type": "application/json",
+            "X-API-Key": self.tavily_api_key
+        }
+        self.tavily_base_payload = {
+            "search_depth": "basic",
+            # Keep the response to the ranked results only
+            "include_answer": False,
+            "include_raw_content": False,
+            "include_images": False
+        }
 
         # Serper settings
         self.serper_api_key = settings.SERPER_API_KEY
         self.serper_search_url = "https://google.serper.dev/search"
+        self.serper_headers = {
+            "X-API-KEY": self.serper_api_key,
+            "Content-Type": "application/json"
+        }
 
         # Brave Search settings
         self.brave_api_key = settings.BRAVE_API_KEY
         self.brave_search_url = "https://api.search.brave.com/res/v1/web/search"
+        self.brave_headers = {
+            "Accept": "application/json",
+            "X-Subscription-Token": self.brave_api_key
+        }
+        self.brave_base_params = {
+            "result_filter": "web"  # Skip news/videos/discussions sections we don't read
+        }
 
         # DuckDuckGo settings (no API key needed)
         self.duckduckgo_search_url = "https://api.duckduckgo.com"
-
-    async def search_google(self, query: str, num_results: int = 5) -> List[SearchResult]:
+        self.duckduckgo_html_url = "https://html.duckduckgo.com/html/"
+        self.duckduckgo_web_url = "https://duckduckgo.com/"
+        self.duckduckgo_base_params = {
+            "format": "json",
+            "no_html": "1",
+            "no_redirect": "1",
+            "t": "AiWebSearchAgent"
+        }
+
+        # Provider name -> search method dispatch table
+        self.providers = {
+            "google": self.search_google,
+            "duckduckgo": self.search_duckduckgo,
+            "searxng": self.search_searxng,
+            "tavily": self.search_tavily,
+            "serper": self.search_serper,
+            "brave": self.search_brave
+        }
+
+    async def search_google(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using Google Custom Search API
         """
         try:
             params = {
-                "key": self.google_api_key,
-                "cx": self.google_search_engine_id,
+                **self.google_base_params,
                 "q": query,
                 "num": min(num_results, 10)  # Google API allows max 10 results per request
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(self.google_search_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                results = []
-                if "items" in data:
-                    for item in data["items"]:
-                        result = SearchResult(
-                            title=item.get("title", ""),
-                            link=item.get("link", ""),
-                            snippet=item.get("snippet", "")
-                        )
-                        results.append(result)
+            response = await self.client.get(self.google_search_url, params=params)
+            response.raise_for_status()
+            data = _loads(response)
 
-                return results
+            return _extract_google(data.get("items"), num_results)
         except Exception as e:
-            logger.error(f"Error in search_google: {str(e)}")
+            logger.error("Error in search_google: %s", e)
             # Return empty results in case of error
             return []
 
-    async def search_duckduckgo(self, query: str, num_results: int = 5) -> List[SearchResult]:
+    async def search_duckduckgo(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using DuckDuckGo
         """
         # For Korean queries, directly use the HTML fallback method which works better
-        if any('\u3131' <= c <= '\u318F' or '\uAC00' <= c <= '\uD7A3' or '\u1100' <= c <= '\u11FF' for c in query):
-            logger.info(f"Korean query detected: {query}. Using HTML scraping directly.")
+        if _HANGUL_PATTERN.search(query):
+            logger.info("Korean query detected: %s. Using HTML scraping directly.", query)
             return await self._search_duckduckgo_html_fallback(query, num_results)
 
         # For non-Korean queries, try the API first
         try:
-            logger.info(f"Performing DuckDuckGo API search for query: {query}")
-
-            params = {
-                "q": query,
-                "format": "json",
-                "no_html": "1",
-                "no_redirect": "1",
-                "t": "AiWebSearchAgent"
-            }
-
-            async with httpx.AsyncClient() as client:
-                response = await client.get(self.duckduckgo_search_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                # Log the raw response for debugging (truncated)
-                logger.debug(f"DuckDuckGo raw response preview: {str(data)[:500]}...")
-
-                results = []
-
-                # Add the abstract result if available
-                if data.get("AbstractText") and data.get("AbstractURL"):
-                    logger.info(f"Found abstract result for query: {query}")
-                    result = SearchResult(
-                        title=data.get("Heading", ""),
-                        link=data.get("AbstractURL", ""),
-                        snippet=data.get("AbstractText", "")
-                    )
+            logger.info("Performing DuckDuckGo API search for query: %s", query)
+
+            params = {**self.duckduckgo_base_params, "q": query}
+
+            response = await self.client.get(self.duckduckgo_search_url, params=params)
+            response.raise_for_status()
+            data = _loads(response)
+
+            # Log the raw response for debugging (truncated)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("DuckDuckGo raw response preview: %s...", str(data)[:500])
+
+            results = []
+
+            # Add the abstract result if available
+            if data.get("AbstractText") and data.get("AbstractURL"):
+                logger.info("Found abstract result for query: %s", query)
+                result = {
+                    "title": data.get("Heading") or "",
+                    "link": data.get("AbstractURL") or "",
+                    "snippet": data.get("AbstractText") or ""
+                }
+                results.append(result)
+
+            # Add related topics
+            related_topics = data.get("RelatedTopics", [])
+            logger.info("Found %s related topics for query: %s", len(related_topics), query)
+
+            for topic in related_topics[:num_results]:
+                if "Text" in topic and "FirstURL" in topic:
+                    result = {
+                        "title": topic.get("Text", "").split(" - ")[0] if " - " in topic.get("Text", "") else topic.get("Text", ""),
+                        "link": topic.get("FirstURL") or "",
+                        "snippet": topic.get("Text") or ""
+                    }
                     results.append(result)
 
-                # Add related topics
-                related_topics = data.get("RelatedTopics", [])
-                logger.info(f"Found {len(related_topics)} related topics for query: {query}")
-
-                for topic in related_topics[:num_results]:
-                    if "Text" in topic and "FirstURL" in topic:
-                        result = SearchResult(
-                            title=topic.get("Text", "").split(" - ")[0] if " - " in topic.get("Text", "") else topic.get("Text", ""),
-                            link=topic.get("FirstURL", ""),
-                            snippet=topic.get("Text", "")
-                        )
+            # If we still don't have enough results, try to use the Infobox
+            if len(results) < num_results and data.get("Infobox") and data.get("Infobox", {}).get("content"):
+                infobox_content = data.get("Infobox", {}).get("content", [])
+                logger.info("Using Infobox with %s items for query: %s", len(infobox_content), query)
+
+                for content in infobox_content[:num_results - len(results)]:
+                    if content.get("data_type") == "link" and content.get("value") and content.get("label"):
+                        result = {
+                            "title": content.get("label") or "",
+                            "link": content.get("value") or "",
+                            "snippet": content.get("label") or ""
+                        }
                         results.append(result)
 
-                # If we still don't have enough results, try to use the Infobox
-                if len(results) < num_results and data.get("Infobox") and data.get("Infobox", {}).get("content"):
-                    infobox_content = data.get("Infobox", {}).get("content", [])
-                    logger.info(f"Using Infobox with {len(infobox_content)} items for query: {query}")
+            logger.info("DuckDuckGo API search returned %s results for query: %s", len(results), query)
 
-                    for content in infobox_content[:num_results - len(results)]:
-                        if content.get("data_type") == "link" and content.get("value") and content.get("label"):
-                            result = SearchResult(
-                                title=content.get("label", ""),
-                                link=content.get("value", ""),
-                                snippet=content.get("label", "")
-                            )
-                            results.append(result)
+            # If no results were found, try the HTML fallback
+            if not results:
+                logger.warning("No results found in DuckDuckGo API for query: %s", query)
+                logger.info("Trying HTML scraping for query: %s", query)
+                return await self._search_duckduckgo_html_fallback(query, num_results)
 
-                logger.info(f"DuckDuckGo API search returned {len(results)} results for query: {query}")
-
-                # If no results were found, try the HTML fallback
-                if not results:
-                    logger.warning(f"No results found in DuckDuckGo API for query: {query}")
-                    logger.info(f"Trying HTML scraping for query: {query}")
-                    return await self._search_duckduckgo_html_fallback(query, num_results)
-
-                return results[:num_results]
+            return results[:num_results]
         except Exception as e:
-            logger.error(f"Error in search_duckduckgo: {str(e)}")
+            logger.error("Error in search_duckduckgo: %s", e)
             # If the API fails, try the HTML scraping fallback
-            logger.info(f"Falling back to HTML scraping for query: {query}")
+            logger.info("Falling back to HTML scraping for query: %s", query)
             return await self._search_duckduckgo_html_fallback(query, num_results)
 
-    async def _search_duckduckgo_html_fallback(self, query: str, num_results: int = 5) -> List[SearchResult]:
+    async def _search_duckduckgo_html_fallback(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Fallback method for DuckDuckGo search using HTML scraping approach
         """
         try:
-            logger.info(f"Using DuckDuckGo HTML fallback for query: {query}")
+            logger.info("Using DuckDuckGo HTML fallback for query: %s", query)
 
             # Use the HTML endpoint with Korean language preference for Korean queries
-            encoded_query = urllib.parse.quote(query)
-            url = f"https://html.duckduckgo.com/html/?q={encoded_query}&kl=kr-kr"
+            response = await self.client.get(
+                self.duckduckgo_html_url,
+                params={"q": query, "kl": "kr-kr"},
+                headers=_DDG_HTML_HEADERS
+            )
+            response.raise_for_status()
+            # Hand the raw bytes to the parser; lexbor decodes UTF-8 natively, so
+            # httpx never builds the decoded text copy of the page
+            html_content = response.content
+
+            logger.debug("Received HTML response of length: %s bytes", len(html_content))
+
+            # Parse the page once with selectolax's lexbor (C) parser and select result nodes by CSS
+            tree = LexborHTMLParser(html_content)
+
+            result_nodes = tree.css("div.result__body")
+            logger.info("Found %s potential result blocks in HTML response", len(result_nodes))
+
+            results = _extract_ddg_html_results(
+                result_nodes[:num_results],
+                title_selector="a.result__a",
+                snippet_selector=".result__snippet",
+                default_snippet="No description available"
+            )
+
+            # If we couldn't find results with the standard approach, try an alternative parsing method
+            if not results:
+                logger.info("Trying alternative HTML parsing method")
+
+                # Try to find results in the format used by DuckDuckGo's newer HTML
+                result_nodes = tree.css("div.web-result")
+                logger.info("Alternative parsing found %s potential result blocks", len(result_nodes))
+
+                results = _extract_ddg_html_results(
+                    result_nodes[:num_results],
+                    title_selector="h2.result__title a",
+                    snippet_selector="div.result__snippet",
+                    default_snippet=""
+                )
 
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7"
-            }
+            logger.info("DuckDuckGo HTML fallback returned %s results for query: %s", len(results), query)
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, headers=headers)
-                response.raise_for_status()
-                html_content = response.text
-
-                logger.debug(f"Received HTML response of length: {len(html_content)} characters")
-
-                # Very basic HTML parsing to extract results
-                results = []
-
-                # Try to find result blocks
-                result_blocks = html_content.split('<div class="result__body')
-
-                logger.info(f"Found {len(result_blocks)-1} potential result blocks in HTML response")
-
-                for i, block in enumerate(result_blocks[1:num_results+1]):  # Skip the first split which is before the first result
-                    try:
-                        # Extract title
-                        title_start = block.find('<a class="result__a" href="')
-                        title_end = block.find('</a>', title_start)
-                        title = block[block.find('>', title_start) + 1:title_end].strip()
-
-                        # Extract link
-                        link_start = block.find('href="', title_start) + 6
-                        link_end = block.find('"', link_start)
-                        link = block[link_start:link_end].strip()
-
-                        # Extract snippet
-                        snippet_start = block.find('<a class="result__snippet"')
-                        if snippet_start == -1:  # Try alternative snippet location
-                            snippet_start = block.find('<div class="result__snippet"')
-
-                        if snippet_start != -1:
-                            snippet_end = block.find('</a>' if '<a class="result__snippet"' in block else '</div>', snippet_start)
-                            snippet = block[block.find('>', snippet_start) + 1:snippet_end].strip()
-                        else:
-                            snippet = "No description available"
-
-                        if title and link:
-                            result = SearchResult(
-                                title=title,
-                                link=link,
-                                snippet=snippet
-                            )
-                            results.append(result)
-                            logger.debug(f"Extracted result {i+1}: Title: {title[:30]}...")
-                        else:
-                            logger.warning(f"Could not extract title or link from result block {i+1}")
-                    except Exception as parsing_error:
-                        logger.error(f"Error parsing HTML result block {i+1}: {str(parsing_error)}")
-                        continue
-
-                # If we couldn't find results with the standard approach, try an alternative parsing method
-                if not results:
-                    logger.info("Trying alternative HTML parsing method")
-
-                    # Look for results in a different format
-                    try:
-                        # Try to find results in the format used by DuckDuckGo's newer HTML
-                        result_blocks = html_content.split('<div class="result results_links results_links_deep web-result">')
-
-                        logger.info(f"Alternative parsing found {len(result_blocks)-1} potential result blocks")
-
-                        for i, block in enumerate(result_blocks[1:num_results+1]):
-                            try:
-                                # Extract title and link
-                                title_section = block.split('<h2 class="result__title">')[1].split('</h2>')[0]
-                                title_start = title_section.find('<a')
-                                title_end = title_section.find('</a>')
-
-                                title = title_section[title_section.find('>', title_start) + 1:title_end].strip()
-
-                                link_start = title_section.find('href="') + 6
-                                link_end = title_section.find('"', link_start)
-                                link = title_section[link_start:link_end].strip()
-
-                                # Extract snippet
-                                snippet = ""
-                                if '<div class="result__snippet">' in block:
-                                    snippet_section = block.split('<div class="result__snippet">')[1].split('</div>')[0]
-                                    snippet = snippet_section.strip()
-
-                                if title and link:
-                                    result = SearchResult(
-                                        title=title,
-                                        link=link,
-                                        snippet=snippet
-                                    )
-                                    results.append(result)
-                                    logger.debug(f"Alternative parsing - Extracted result {i+1}: Title: {title[:30]}...")
-                            except Exception as alt_parsing_error:
-                                logger.error(f"Error in alternative parsing for block {i+1}: {str(alt_parsing_error)}")
-                                continue
-                    except Exception as alt_method_error:
-                        logger.error(f"Error in alternative parsing method: {str(alt_method_error)}")
-
-                logger.info(f"DuckDuckGo HTML fallback returned {len(results)} results for query: {query}")
+            if not results:
+                # If still no results, try a direct web search as a last resort
+                logger.warning("No results found in DuckDuckGo HTML fallback for query: %s", query)
 
-                if not results:
-                    # If still no results, try a direct web search as a last resort
-                    logger.warning(f"No results found in DuckDuckGo HTML fallback for query: {query}")
-
-                    # Try a direct web search using a different URL format
-                    try:
-                        logger.info("Trying direct web search as last resort")
-                        direct_url = f"https://duckduckgo.com/?q={encoded_query}&kl=kr-kr&ia=web"
-
-                        async with httpx.AsyncClient() as direct_client:
-                            direct_response = await direct_client.get(direct_url, headers=headers)
-                            direct_response.raise_for_status()
-
-                            # Create a minimal result with the search URL
-                            results.append(SearchResult(
-                                title=f"DuckDuckGo search results for: {query}",
-                                link=direct_url,
-                                snippet=f"Click to view web search results for '{query}' on DuckDuckGo."
-                            ))
-                            logger.info("Added direct search link as a fallback result")
-                    except Exception as direct_search_error:
-                        logger.error(f"Error in direct web search fallback: {str(direct_search_error)}")
-
-                return results
+                # Try a direct web search using a different URL format
+                try:
+                    logger.info("Trying direct web search as last resort")
+                    direct_response = await self.client.get(
+                        self.duckduckgo_web_url,
+                        params={"q": query, "kl": "kr-kr", "ia": "web"},
+                        headers=_DDG_HTML_HEADERS
+                    )
+                    direct_response.raise_for_status()
+
+                    # Create a minimal result with the search URL
+                    results.append({
+                        "title": f"DuckDuckGo search results for: {query}",
+                        "link": str(direct_response.request.url),
+                        "snippet": f"Click to view web search results for '{query}' on DuckDuckGo."
+                    })
+                    logger.info("Added direct search link as a fallback result")
+                except Exception as direct_search_error:
+                    logger.error("Error in direct web search fallback: %s", direct_search_error)
+
+            return results
         except Exception as e:
-            logger.error(f"Error in _search_duckduckgo_html_fallback: {str(e)}")
+            logger.error("Error in _search_duckduckgo_html_fallback: %s", e)
             return []
 
-    async def search_searxng(self, query: str, num_results: int = 5) -> List[SearchResult]:
+    async def search_searxng(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using SearXNG instance
         """
         try:
-            params = {
-                "q": query,
-                "format": "json",
-                "categories": "general",
-                "language": "en-US",
-                "count": num_results
-            }
+            params = {**self.searxng_base_params, "q": query, "count": num_results}
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.searxng_url}/search", params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                results = []
-                for result in data.get("results", [])[:num_results]:
-                    search_result = SearchResult(
-                        title=result.get("title", ""),
-                        link=result.get("url", ""),
-                        snippet=result.get("content", "")
-                    )
-                    results.append(search_result)
+            response = await self.client.get(self.searxng_search_url, params=params)
+            response.raise_for_status()
+            data = _loads(response)
 
-                return results
+            return _extract_searxng(data.get("results"), num_results)
         except Exception as e:
-            logger.error(f"Error in search_searxng: {str(e)}")
+            logger.error("Error in search_searxng: %s", e)
             return []
 
-    async def search_tavily(self, query: str, num_results: int = 5) -> List[SearchResult]:
+    async def search_tavily(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using Tavily API
         """
         try:
-            headers = {
-                "Content-Type": "application/json",
-                "X-API-Key": self.tavily_api_key
-            }
-
-            payload = {
-                "query": query,
-                "max_results": num_results,
-                "search_depth": "basic"
-            }
+            payload = {**self.tavily_base_payload, "query": query, "max_results": num_results}
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.tavily_search_url,
-                    headers=headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                results = []
-                for result in data.get("results", [])[:num_results]:
-                    search_result = SearchResult(
-                        title=result.get("title", ""),
-                        link=result.get("url", ""),
-                        snippet=result.get("content", "")
-                    )
-                    results.append(search_result)
+            response = await self.client.post(
+                self.tavily_search_url,
+                headers=self.tavily_headers,
+                content=orjson.dumps(payload)
+            )
+            response.raise_for_status()
+            data = _loads(response)
 
-                return results
+            return _extract_tavily(data.get("results"), num_results)
         except Exception as e:
-            logger.error(f"Error in search_tavily: {str(e)}")
+            logger.error("Error in search_tavily: %s", e)
             return []
 
-    async def search_serper(self, query: str, num_results: int = 5) -> List[SearchResult]:
+    async def search_serper(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using Serper API
         """
         try:
-            headers = {
-                "X-API-KEY": self.serper_api_key,
-                "Content-Type": "application/json"
-            }
+            payload = {"q": query, "num": num_results}
 
-            payload = {
-                "q": query,
-                "num": num_results
-            }
-
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.serper_search_url,
-                    headers=headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                results = []
-                for result in data.get("organic", [])[:num_results]:
-                    search_result = SearchResult(
-                        title=result.get("title", ""),
-                        link=result.get("link", ""),
-                        snippet=result.get("snippet", "")
-                    )
-                    results.append(search_result)
+            response = await self.client.post(
+                self.serper_search_url,
+                headers=self.serper_headers,
+                content=orjson.dumps(payload)
+            )
+            response.raise_for_status()
+            data = _loads(response)
 
-                return results
+            return _extract_serper(data.get("organic"), num_results)
         except Exception as e:
-            logger.error(f"Error in search_serper: {str(e)}")
+            logger.error("Error in search_serper: %s", e)
             return []
 
-    async def search_brave(self, query: str, num_results: int = 5) -> List[SearchResult]:
+    async def search_brave(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using Brave Search API
         """
         try:
-            headers = {
-                "Accept": "application/json",
-                "X-Subscription-Token": self.brave_api_key
-            }
-
             params = {
+                **self.brave_base_params,
                 "q": query,
                 "count": min(num_results, 20)  # Brave API limit
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    self.brave_search_url,
-                    headers=headers,
-                    params=params
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                results = []
-                for result in data.get("web", {}).get("results", [])[:num_results]:
-                    search_result = SearchResult(
-                        title=result.get("title", ""),
-                        link=result.get("url", ""),
-                        snippet=result.get("description", "")
-                    )
-                    results.append(search_result)
+            response = await self.client.get(
+                self.brave_search_url,
+                headers=self.brave_headers,
+                params=params
+            )
+            response.raise_for_status()
+            data = _loads(response)
 
-                return results
+            return _extract_brave((data.get("web") or {}).get("results"), num_results)
         except Exception as e:
-            logger.error(f"Error in search_brave: {str(e)}")
+            logger.error("Error in search_brave: %s", e)
             return []
 
     async def search(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a search using the configured search provider
         """
-        results: List[SearchResult] = []
+        # Serve repeated queries from the cache without hitting the provider
+        cache_key = (self.search_provider, query.strip().lower(), num_results)
+        cached_results = _search_cache.get(cache_key)
+        if cached_results is not None:
+            logger.info("Cache hit for query: %s", query)
+            return list(cached_results)
+
+        # Single-flight: concurrent identical queries await the search already in flight
+        inflight = _inflight_searches.get(cache_key)
+        if inflight is not None:
+            logger.info("Joining in-flight search for query: %s", query)
+            try:
+                return list(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The leading search was cancelled, not this caller, so search again
+                return await self.search(query, num_results)
+
+        future = asyncio.get_running_loop().create_future()
+        # Mark a failure as retrieved even when no follower awaited the shared future
+        future.add_done_callback(_consume_exception)
+        _inflight_searches[cache_key] = future
+        try:
+            search_results = await self._search_uncached(query, num_results, cache_key)
+            future.set_result(tuple(search_results))
+            return search_results
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if _inflight_searches.get(cache_key) is future:
+                del _inflight_searches[cache_key]
+            if not future.done():
+                future.cancel()
+
+    async def _search_uncached(self, query: str, num_results: int, cache_key: Tuple[str, str, int]) -> List[Dict[str, Any]]:
+        """
+        Resolve a search that missed the in-process cache via Redis or the search provider
+        """
+        # Fall back to the shared Redis tier, if configured
+        redis_cache = get_redis_cache()
+        redis_key = None
+        if redis_cache is not None:
+            query_hash = hashlib.sha1(cache_key[1].encode("utf-8")).hexdigest()
+            redis_key = f"srch:{self.search_provider}:{num_results}:{query_hash}"
+            redis_payload = await redis_cache.get(redis_key)
+            if redis_payload is not None:
+                logger.info("Redis cache hit for query: %s", query)
+                search_results = orjson.loads(redis_payload)
+                _search_cache[cache_key] = tuple(search_results)
+                return search_results
 
         # Select the appropriate search provider based on configuration
-        if self.search_provider == "google":
-            results = await self.search_google(query, num_results)
-        elif self.search_provider == "duckduckgo":
-            results = await self.search_duckduckgo(query, num_results)
-        elif self.search_provider == "searxng":
-            results = await self.search_searxng(query, num_results)
-        elif self.search_provider == "tavily":
-            results = await self.search_tavily(query, num_results)
-        elif self.search_provider == "serper":
-            results = await self.search_serper(query, num_results)
-        elif self.search_provider == "brave":
-            results = await self.search_brave(query, num_results)
-        else:
+        provider_search = self.providers.get(self.search_provider)
+        if provider_search is None:
             # Default to DuckDuckGo if provider is not recognized
-            logger.warning(f"Unrecognized search provider: {self.search_provider}. Using DuckDuckGo as fallback.")
-            results = await self.search_duckduckgo(query, num_results)
-
-        # If the selected provider returned no results, try DuckDuckGo as a fallback
-        if not results and self.search_provider != "duckduckgo":
-            logger.info(f"No results from {self.search_provider}, trying DuckDuckGo as fallback")
-            results = await self.search_duckduckgo(query, num_results)
+            logger.warning("Unrecognized search provider: %s. Using DuckDuckGo as fallback.", self.search_provider)
+            provider_search = self.search_duckduckgo
 
-        # Convert to dict for easier handling
-        return [result.model_dump() for result in results]
+        if provider_search == self.search_duckduckgo:
+            results = await provider_search(query, num_results)
+        else:
+            # Run the DuckDuckGo fallback concurrently with the selected provider so an
+            # empty or failed primary costs max(primary, fallback) instead of the sum
+            primary_task = asyncio.create_task(provider_search(query, num_results))
+            fallback_task = asyncio.create_task(self.search_duckduckgo(query, num_results))
+            try:
+                # Cap the primary provider so a stuck upstream falls through to DuckDuckGo
+                try:
+                    results = await asyncio.wait_for(primary_task, timeout=settings.SEARCH_PROVIDER_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("%s timed out after %ss", self.search_provider, settings.SEARCH_PROVIDER_TIMEOUT)
+                    results = []
+
+                # If the selected provider returned no results, use the DuckDuckGo fallback
+                if not results:
+                    logger.info("No results from %s, using DuckDuckGo fallback", self.search_provider)
+                    results = await fallback_task
+            finally:
+                if not fallback_task.done():
+                    fallback_task.cancel()
+
+        # Only cache non-empty results so transient provider failures are retried
+        if results:
+            _search_cache[cache_key] = tuple(results)
+            if redis_cache is not None:
+                await redis_cache.setex(redis_key, settings.REDIS_CACHE_TTL, orjson.dumps(results))
+
+        return results
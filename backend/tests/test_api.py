@@ -1,11 +1,21 @@
+import httpx
 import pytest
-from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 
 from app.main import app
 from app.models.schemas import AgentResponse, AgentSearchStep
 
-client = TestClient(app)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# Call the app in-process over ASGI instead of through TestClient's thread bridge
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
 
 # Mock data
 mock_search_results = [
@@ -28,14 +38,16 @@ mock_agent_response = AgentResponse(
 )
 
 # Test health check endpoint
-def test_health_check():
-    response = client.get("/api/v1/health")
+@pytest.mark.anyio
+async def test_health_check(client):
+    response = await client.get("/api/v1/health")
     assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
 # Test authentication
-def test_login():
-    response = client.post(
+@pytest.mark.anyio
+async def test_login(client):
+    response = await client.post(
         "/api/v1/auth/login",
         data={"username": "admin", "password": "password"}
     )
@@ -44,22 +56,23 @@ def test_login():
     assert response.json()["token_type"] == "bearer"
 
 # Test search endpoint with authentication
+@pytest.mark.anyio
 @patch("app.api.routes.get_agent_service")
-def test_search_with_auth(mock_get_agent_service):
+async def test_search_with_auth(mock_get_agent_service, client):
     # Mock the agent service
     mock_agent = MagicMock()
     mock_agent.process_prompt.return_value = mock_agent_response
     mock_get_agent_service.return_value = mock_agent
     
     # Get auth token
-    auth_response = client.post(
+    auth_response = await client.post(
         "/api/v1/auth/login",
         data={"username": "admin", "password": "password"}
     )
     token = auth_response.json()["access_token"]
     
     # Test search endpoint
-    response = client.post(
+    response = await client.post(
         "/api/v1/search",
         headers={"Authorization": f"Bearer {token}"},
         json={"prompt": "test prompt"}
@@ -71,8 +84,9 @@ def test_search_with_auth(mock_get_agent_service):
     assert response.json()["final_report"] == "This is a test report"
 
 # Test search endpoint without authentication
-def test_search_without_auth():
-    response = client.post(
+@pytest.mark.anyio
+async def test_search_without_auth(client):
+    response = await client.post(
         "/api/v1/search",
         json={"prompt": "test prompt"}
     )
@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+from cachetools import TTLCache
+from unittest.mock import patch
+
+from app.services import search_service
+from app.services.search_service import SearchService
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# Fresh caches per test, with the Redis tier disabled
+@pytest.fixture(autouse=True)
+def clean_caches():
+    search_service._search_cache.clear()
+    search_service._inflight_searches.clear()
+    with patch("app.services.search_service.get_redis_cache", return_value=None):
+        yield
+    search_service._search_cache.clear()
+    search_service._inflight_searches.clear()
+
+
+mock_search_results = [
+    {"title": "Test Result 1", "link": "https://example.com/1", "snippet": "This is a test result 1"},
+    {"title": "Test Result 2", "link": "https://example.com/2", "snippet": "This is a test result 2"}
+]
+
+
+def make_service(provider):
+    """Build a SearchService whose DuckDuckGo provider is replaced by the given coroutine function"""
+    service = SearchService()
+    service.search_provider = "duckduckgo"
+    service.search_duckduckgo = provider
+    service.providers["duckduckgo"] = provider
+    return service
+
+
+class FakeProvider:
+    """Counts calls and optionally waits on an event before answering"""
+
+    def __init__(self, gate=None, error=None):
+        self.calls = 0
+        self.gate = gate
+        self.error = error
+
+    async def __call__(self, query, num_results):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return list(mock_search_results)
+
+
+# Test that a repeated query is served from the in-process cache
+@pytest.mark.anyio
+async def test_search_cache_hit():
+    provider = FakeProvider()
+    service = make_service(provider)
+
+    first = await service.search("Test Query", 2)
+    second = await service.search("  test query ", 2)
+
+    assert first == mock_search_results
+    assert second == mock_search_results
+    assert provider.calls == 1
+
+
+# Test that an expired cache entry goes back to the provider
+@pytest.mark.anyio
+async def test_search_cache_expiry():
+    now = [0.0]
+    cache = TTLCache(maxsize=16, ttl=60, timer=lambda: now[0])
+    provider = FakeProvider()
+    service = make_service(provider)
+
+    with patch.object(search_service, "_search_cache", cache):
+        await service.search("test query", 2)
+        now[0] = 30.0
+        await service.search("test query", 2)
+        assert provider.calls == 1
+
+        now[0] = 61.0
+        await service.search("test query", 2)
+        assert provider.calls == 2
+
+
+# Test that empty results are not cached
+@pytest.mark.anyio
+async def test_search_empty_results_not_cached():
+    calls = []
+
+    async def empty_provider(query, num_results):
+        calls.append(query)
+        return []
+
+    service = make_service(empty_provider)
+
+    assert await service.search("test query", 2) == []
+    assert await service.search("test query", 2) == []
+    assert len(calls) == 2
+
+
+# Test that concurrent identical searches share one provider call
+@pytest.mark.anyio
+async def test_concurrent_searches_single_flight():
+    gate = asyncio.Event()
+    provider = FakeProvider(gate=gate)
+    service = make_service(provider)
+
+    tasks = [asyncio.create_task(service.search("test query", 2)) for _ in range(5)]
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(*tasks)
+
+    assert provider.calls == 1
+    assert all(result == mock_search_results for result in results)
+    assert not search_service._inflight_searches
+
+
+# Test that a failed leader passes its error to followers
+@pytest.mark.anyio
+async def test_concurrent_searches_leader_failure():
+    gate = asyncio.Event()
+    provider = FakeProvider(gate=gate, error=RuntimeError("provider down"))
+    service = make_service(provider)
+
+    leader = asyncio.create_task(service.search("test query", 2))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(service.search("test query", 2))
+    await asyncio.sleep(0)
+    gate.set()
+
+    results = await asyncio.gather(leader, follower, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert provider.calls == 1
+
+
+# Test that a failed search with no followers does not leave "exception was never retrieved" behind
+@pytest.mark.anyio
+async def test_failed_search_exception_retrieved():
+    gate = asyncio.Event()
+    service = make_service(FakeProvider(gate=gate, error=RuntimeError("provider down")))
+
+    leader = asyncio.create_task(service.search("test query", 2))
+    await asyncio.sleep(0)
+    future = search_service._inflight_searches[("duckduckgo", "test query", 2)]
+    gate.set()
+
+    with pytest.raises(RuntimeError):
+        await leader
+    assert future.done()
+    assert not future._log_traceback
+
+
+# Test that followers search again when the leader is cancelled
+@pytest.mark.anyio
+async def test_follower_retries_after_leader_cancelled():
+    gate = asyncio.Event()
+    provider = FakeProvider(gate=gate)
+    service = make_service(provider)
+
+    leader = asyncio.create_task(service.search("test query", 2))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(service.search("test query", 2))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    gate.set()
+
+    assert await follower == mock_search_results
+    assert provider.calls == 2
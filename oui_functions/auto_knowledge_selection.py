@@ -1,5 +1,11 @@
+import asyncio
+import hashlib
 import json
+import logging
+import operator
 import re
+import sys
+import time
 import traceback
 from datetime import datetime
 from pydantic import BaseModel, Field
@@ -13,182 +19,101 @@ from open_webui.models.knowledge import Knowledges
 from open_webui.models.files import Files
 from open_webui.utils.middleware import chat_web_search_handler
 
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
 
-def print_log(level: str, message: str):
-    """콘솔에 로그를 출력하는 함수"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] [{level.upper()}] {message}")
 
-
-def log_error(request_id, e, error_info=None, additional_info=None):
-    """오류 정보를 출력하는 함수"""
-    print_log("error", f"[{request_id}] 예외 발생: {e}")
-
-    if error_info:
-        print_log("error", f"[{request_id}] 상세 오류 정보:\n{error_info}")
-
-    if additional_info:
-        print_log("error", f"[{request_id}] 추가 정보: {additional_info}")
-
-    if "'NoneType' object has no attribute 'get'" in str(e):
-        print_log(
-            "error", f"[{request_id}] NoneType 오류 특별 진단 시작 ---------------"
+# 콘솔 로거 (비활성화된 레벨의 메시지는 포맷팅 비용 없이 무시됨)
+logger = logging.getLogger("auto_knowledge_selection")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(
+        logging.Formatter(
+            "[%(asctime)s] [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
         )
-        stack_trace = traceback.format_exc()
-        frame_info = []
-        for i, line in enumerate(stack_trace.splitlines()):
-            if "File " in line:
-                frame_info.append(line.strip())
-
-        if frame_info:
-            print_log("error", f"[{request_id}] 호출 스택 정보:")
-            for frame in frame_info:
-                print_log("error", f"[{request_id}]   {frame}")
-
-        print_log(
-            "error", f"[{request_id}] NoneType 오류 특별 진단 종료 ---------------"
-        )
-
-
-def parse_json_content(content: str) -> Optional[dict]:
-    """JSON 문자열을 파싱하여 딕셔너리로 변환"""
-
-    def try_load_json(json_str: str) -> Optional[dict]:
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            return None
-
-    content = content.strip()
-
-    if content.lower() == "none":
-        return None
-
-    if content.startswith("{") and content.endswith("}"):
-        parsed_data = try_load_json(content)
-        if parsed_data is not None:
-            return parsed_data
-
-        content_single_to_double = content.replace("'", '"')
-        parsed_data = try_load_json(content_single_to_double)
-        if parsed_data is not None:
-            return parsed_data
-
-        return None
-
-    match = re.search(r"\{.*?\}", content, flags=re.DOTALL)
-    if not match:
-        return None
-
-    json_str = match.group(0)
-
-    parsed_data = try_load_json(json_str)
-    if parsed_data is not None:
-        return parsed_data
-
-    json_str_converted = json_str.replace("'", '"')
-    parsed_data = try_load_json(json_str_converted)
-    if parsed_data is not None:
-        return parsed_data
-
-    return None
-
-
-class Filter:
-    class Valves(BaseModel):
-        status: bool = Field(default=True)
-        auto_search_mode: bool = Field(default=False)
-        plan_model: str = Field(default="gpt-4.1-mini")
-
-    def __init__(self):
-        self.valves = self.Valves()
-        print_log("info", "Auto Knowledge Selection 필터 초기화됨")
-
-    async def emit_status(
-        self,
-        __event_emitter__: Callable[[dict], Awaitable[None]],
-        level: str,
-        message: str = "",
-        done: bool = False,
-    ):
-        if self.valves.status:
-            await __event_emitter__(
-                {
-                    "type": level,
-                    "data": {
-                        "description": message,
-                        "done": done,
-                    },
-                }
-            )
-
-    async def select_knowledge_base(
-        self, body: dict, __user__: Optional[dict]
-    ) -> Optional[dict]:
-        """사용자의 메시지를 바탕으로 적절한 Knowledge Base를 선택"""
-        messages = body["messages"] 
-        user_message = get_last_user_message(messages)
-
-        all_knowledge_bases = Knowledges.get_knowledge_bases_by_user_id(
-            __user__.get("id"), "read"
-        )
-
-        knowledge_bases_list = "\n\n".join(
-            [
-                f"--- Knowledge Base {index + 1} ---\n"
-                f"ID: {getattr(knowledge_base, 'id', 'Unknown')}\n"
-                f"Name: {getattr(knowledge_base, 'name', 'Unknown')}\n"
-                f"Description: {getattr(knowledge_base, 'description', 'Unknown')}"
-                for index, knowledge_base in enumerate(all_knowledge_bases)
-            ]
-        )
-
-        system_prompt = f"""You are a system that selects the most appropriate knowledge bases for the user's query.
-Below is a list of knowledge bases accessible by the user. 
+    )
+    logger.addHandler(_log_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# LLM 응답에서 JSON 객체를 정규식 없이 한 번에 찾아 파싱하는 디코더
+_JSON_DECODER = json.JSONDecoder()
+
+# 작은따옴표 JSON을 큰따옴표로 바꾸는 변환 테이블
+_SINGLE_TO_DOUBLE = str.maketrans("'", '"')
+
+# 최종 답변 모델에 주입하는 공통 system 메시지 (매 턴 동일한 prefix를 유지)
+_CONTEXT_SYSTEM_CONTENT = (
+    "You are a multidisciplinary expert with contextual adaptation capabilities. You possess deep expertise in the following fields: project management, psychology, economics, design, marketing, and engineering. You are able to use this knowledge in an integrated manner while adapting your approach to the specific needs of each request.\n\n"
+    "The user is seeking high-level expertise to answer their questions or help them with their professional and personal projects. Each request may require a different level of depth, communication style, and analytical framework.\n\n"
+    "Basic Structure for All Responses:\n"
+    "1. Begin by precisely understanding the request, asking clarifying questions if necessary.\n"
+    "2. Adapt your depth level according to the context (quick response or in-depth analysis).\n"
+    "3. Use clear and accessible language, avoiding corporate jargon unless relevant.\n"
+    "4. Check the logical consistency of your response before finalizing it.\n"
+    "5. End with a bullet-point summary of the essential elements to remember.\n\n"
+    "Analytical Approach (to apply as relevant):\n"
+    "- Leverage your interdisciplinary expertise (PM, psychology, economics, design, marketing, engineering).\n"
+    "- Cite relevant references when they strengthen your point (e.g., Ries, 2011; McKinsey, 2021).\n"
+    "- After each analysis, check your logic against recognized theoretical frameworks (Gibson, 2022).\n"
+    "- Highlight any contradictions or tensions in the analysis.\n"
+    "- Use recognized analytical frameworks when appropriate (RICE, OKRs, Double Diamond, etc.).\n"
+    "- Identify potentially problematic assumptions using data or logic.\n\n"
+    "Response Enrichment (to use selectively):\n"
+    "- Illustrate your points with concrete and concise anecdotes.\n"
+    "- Integrate relevant academic knowledge by explaining it simply.\n"
+    "- Propose alternative scenario simulations when it helps decision-making.\n"
+    "- Present the advantages and disadvantages of different options when a decision needs to be made.\n"
+    "- Structure complex points in narrative form to facilitate understanding.\n\n"
+    "Contextual Adaptation:\n"
+    "- Keep in memory the objectives and constraints mentioned previously in the conversation.\n"
+    "- If the user seems stressed, acknowledge it and suggest concrete steps to move forward.\n"
+    "- Maintain consistency in the terminology used unless requested otherwise.\n"
+    "- Follow a continuous improvement process by taking into account user feedback.\n"
+    "- Keep track of recurring topics to allow for further exploration later.\n\n"
+    "Output Format:\n"
+    "1. A direct answer to the main question\n"
+    "2. A structured analysis using relevant techniques\n"
+    "3. Concrete examples or illustrations if appropriate\n"
+    "4. A final bullet-point summary\n"
+    "5. Follow-up or further exploration suggestions if relevant\n\n"
+    "**IMPORTANT: Additionally, please respond in the language used by the user in their input.**\n\n"
+)
+_CONTEXT_MESSAGE = {"role": "system", "content": _CONTEXT_SYSTEM_CONTENT}
+
+# 단순 질문이 아님이 분명한 요청(문서 참조, 분석, 검색 등)의 키워드
+_NON_SIMPLE_HINTS = re.compile(
+    r"(요약|분석|첨부|문서|검색|비교|attached|search|compare)", re.I
+)
+
+# 인사말만으로 이루어진 메시지
+_GREETING_PATTERN = re.compile(
+    r"^\s*(안녕하세요|안녕|반가워요|반갑습니다|고마워요|고마워|감사합니다|hi|hello|hey|thanks|thank you)[\s!.?~]*$",
+    re.I,
+)
+
+# 계획용 system 프롬프트는 요청마다 바이트 단위로 동일해야 LLM 제공자의 prompt cache가 적중함
+_KNOWLEDGE_BASE_SYSTEM_PROMPT = """You are a system that selects the most appropriate knowledge bases for the user's query.
+The user message lists the knowledge bases accessible by the user under "Available knowledge bases". 
 Based on the user's prompt, return the 1-3 most relevant knowledge bases as an array. 
 If no relevant knowledge bases are applicable, return an "None" without any explanation.
 
-Available knowledge bases:
-{knowledge_bases_list}
-
 Return the result in the following JSON format (no extra keys, no explanations):
-{{
+{
     "selected_knowledge_bases": 
         [
-            {{
+            {
                 "id": <KnowledgeBaseID>,
                 "name": <KnowledgeBaseName>
-            }},
+            },
             ...
         ]
-}}
+}
 """
 
-        prompt = (
-            "History:\n"
-            + "\n".join(
-                [
-                    f"{message['role'].upper()}: \"\"\"{message['content']}\"\"\""
-                    for message in messages[::-1][:4]
-                ]
-            )
-            + f"\nUser query: {user_message}"
-        )
-
-        return {
-            "system_prompt": system_prompt,
-            "prompt": prompt,
-            "model": self.valves.plan_model,
-        }
-
-    async def determine_web_search_needed(
-        self, body: dict, __user__: Optional[dict]
-    ) -> Optional[dict]:
-        """사용자의 메시지를 바탕으로 웹 검색 필요 여부를 판단"""
-        messages = body["messages"]
-        user_message = get_last_user_message(messages)
-
-        system_prompt = """You are a system that determines if a web search is needed for the user's query.
+_WEB_SEARCH_SYSTEM_PROMPT = """You are a system that determines if a web search is needed for the user's query.
 
 Consider the following when making your decision:
 1. If the query relates to real-time or up-to-date information, including recurring events 
@@ -216,31 +141,7 @@ Return the result in the following JSON format:
     "web_search_enabled": boolean
 }"""
 
-        prompt = (
-            "History:\n"
-            + "\n".join(
-                [
-                    f"{message['role'].upper()}: \"\"\"{message['content']}\"\"\""
-                    for message in messages[::-1][:4]
-                ]
-            )
-            + f"\nUser query: {user_message}"
-        )
-
-        return {
-            "system_prompt": system_prompt,
-            "prompt": prompt,
-            "model": self.valves.plan_model,
-        }
-
-    async def determine_simple_query(
-        self, body: dict, __user__: Optional[dict]
-    ) -> Optional[dict]:
-        """사용자의 메시지가 단순 질문인지 판단하는 함수"""
-        messages = body["messages"]
-        user_message = get_last_user_message(messages)
-
-        system_prompt = """당신은 사용자의 질문이 단순한 질문인지 아닌지를 판단하는 시스템입니다.
+_SIMPLE_QUERY_SYSTEM_PROMPT = """당신은 사용자의 질문이 단순한 질문인지 아닌지를 판단하는 시스템입니다.
 
 다음과 같은 경우를 단순 질문으로 간주합니다:
 1. 인사말 (예: "안녕하세요", "좋은 아침입니다")
@@ -264,22 +165,256 @@ Return the result in the following JSON format:
     "reason": "판단 이유를 간단히 설명"
 }"""
 
-        prompt = (
-            "History:\n"
-            + "\n".join(
-                [
-                    f"{message['role'].upper()}: \"\"\"{message['content']}\"\"\""
-                    for message in messages[::-1][:4]
-                ]
+
+def cache_get(cache: dict, key: Any) -> Any:
+    """TTL 캐시에서 만료되지 않은 값을 반환 (없거나 만료되면 None)"""
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    if cached[0] <= time.monotonic():
+        cache.pop(key, None)
+        return None
+    return cached[1]
+
+
+def cache_put(cache: dict, key: Any, value: Any, ttl: int, maxsize: int):
+    """TTL 캐시에 값을 저장 (ttl이 0 이하이면 저장하지 않음)"""
+    if ttl <= 0:
+        return
+    if key not in cache and len(cache) >= maxsize:
+        # 가장 오래된 항목부터 제거
+        cache.pop(next(iter(cache)))
+    cache[key] = (time.monotonic() + ttl, value)
+
+
+# 대화 기록 프롬프트에 쓰는 역할 이름 (고정된 역할은 매번 upper() 하지 않음)
+_ROLE_UPPER = {
+    "user": "USER",
+    "assistant": "ASSISTANT",
+    "system": "SYSTEM",
+    "tool": "TOOL",
+}
+
+# 문자열로 반환된 boolean 값 중 참으로 간주하는 값
+_TRUTHY_STRINGS = frozenset({"true", "yes", "y", "t", "1"})
+
+# Knowledge Base 모델에서 프롬프트에 쓰는 필드를 한 번에 읽는 getter
+_KB_FIELDS = operator.attrgetter("id", "name", "description")
+
+# 사용자별 Knowledge Base 목록 프롬프트 캐시: {user_id: (만료 시각, 목록 문자열)}
+# Open WebUI의 KB 변경 경로에서 이 캐시를 비울 방법이 없으므로, 변경 사항은 최대 kb_list_cache_ttl초 늦게 반영된다
+_KB_LIST_CACHE_MAXSIZE = 1024
+_kb_list_cache: dict = {}
+
+
+def get_knowledge_bases_list(user_id: str, ttl: int) -> str:
+    """사용자가 읽을 수 있는 Knowledge Base 목록을 프롬프트 문자열로 반환 (TTL 캐시)"""
+    cached = cache_get(_kb_list_cache, user_id)
+    if cached is not None:
+        return cached
+
+    all_knowledge_bases = Knowledges.get_knowledge_bases_by_user_id(user_id, "read")
+
+    # KB마다 조각을 리스트에 모아 마지막에 한 번만 join
+    parts = []
+    append = parts.append
+    for index, (kb_id, kb_name, kb_description) in enumerate(
+        map(_KB_FIELDS, all_knowledge_bases), 1
+    ):
+        if index > 1:
+            append("\n\n")
+        append("--- Knowledge Base ")
+        append(str(index))
+        append(" ---\nID: ")
+        append(str(kb_id))
+        append("\nName: ")
+        append(str(kb_name))
+        append("\nDescription: ")
+        append(str(kb_description))
+    knowledge_bases_list = "".join(parts)
+
+    cache_put(
+        _kb_list_cache, user_id, knowledge_bases_list, ttl, _KB_LIST_CACHE_MAXSIZE
+    )
+
+    return knowledge_bases_list
+
+
+# 계획용 LLM 응답 캐시: {(모델, system 프롬프트, user 프롬프트) 해시: (만료 시각, 응답)}
+_PLAN_CACHE_MAXSIZE = 4096
+_plan_cache: dict = {}
+
+
+def build_plan_payload(system_prompt: str, prompt: str, model: str) -> dict:
+    """계획용 LLM 호출 payload 생성"""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ],
+        "stream": False,
+    }
+
+
+async def generate_plan_completion(
+    request: Any, system_prompt: str, prompt: str, model: str, user: Any, ttl: int
+) -> Optional[dict]:
+    """계획용 LLM 호출 (동일한 모델과 프롬프트 조합은 TTL 동안 이전 응답을 재사용)"""
+    key = hashlib.blake2b(
+        f"{model}\0{system_prompt}\0{prompt}".encode(),
+        digest_size=16,
+    ).digest()
+    cached = cache_get(_plan_cache, key)
+    if cached is not None:
+        return cached
+
+    response = await generate_chat_completion(
+        request=request,
+        form_data=build_plan_payload(system_prompt, prompt, model),
+        user=user,
+    )
+    if isinstance(response, dict):
+        cache_put(_plan_cache, key, response, ttl, _PLAN_CACHE_MAXSIZE)
+    return response
+
+
+def build_history_prompt(messages: list, user_message: str, n: int = 4) -> str:
+    """최근 대화 n개(최신순)와 마지막 사용자 질문으로 계획용 user 프롬프트 생성"""
+    history_lines = []
+    for message in reversed(messages[-n:]):
+        role = message["role"]
+        role_name = _ROLE_UPPER.get(role) or role.upper()
+        history_lines.append(f'{role_name}: """{message["content"]}"""')
+    history = "\n".join(history_lines)
+    return f"History:\n{history}\nUser query: {user_message}"
+
+
+def classify_query_locally(user_message: str, body: dict) -> Optional[bool]:
+    """LLM 호출 없이 판단 가능한 경우 단순 질문 여부를 반환 (애매하면 None)"""
+    if (
+        len(user_message) > 400
+        or "```" in user_message
+        or "http://" in user_message
+        or "https://" in user_message
+        or body.get("files")
+        or _NON_SIMPLE_HINTS.search(user_message)
+    ):
+        return False
+    if len(user_message) < 20 and _GREETING_PATTERN.match(user_message):
+        return True
+    return None
+
+
+def log_error(request_id, e, additional_info=None):
+    """오류 정보를 출력하는 함수"""
+    if not logger.isEnabledFor(logging.ERROR):
+        return
+
+    # traceback은 exc_info로 넘겨 실제로 출력될 때만 포맷팅
+    logger.error("[%s] 예외 발생: %s", request_id, e, exc_info=e)
+
+    if additional_info:
+        logger.error("[%s] 추가 정보: %s", request_id, additional_info)
+
+    if "'NoneType' object has no attribute 'get'" in str(e):
+        logger.error("[%s] NoneType 오류 특별 진단 시작 ---------------", request_id)
+        frame_info = [
+            (frame.f_code.co_filename, lineno, frame.f_code.co_name)
+            for frame, lineno in traceback.walk_tb(e.__traceback__)
+        ]
+
+        if frame_info:
+            logger.error("[%s] 호출 스택 정보:", request_id)
+            for filename, lineno, name in frame_info:
+                logger.error(
+                    '[%s]   File "%s", line %s, in %s', request_id, filename, lineno, name
+                )
+
+        logger.error("[%s] NoneType 오류 특별 진단 종료 ---------------", request_id)
+
+
+def parse_json_content(content: str) -> Optional[dict]:
+    """JSON 문자열을 파싱하여 딕셔너리로 변환"""
+
+    def try_decode_json(json_str: str) -> Optional[dict]:
+        # 앞뒤에 설명 문구가 붙은 응답도 처리하도록 '{' 위치마다 한 번에 디코딩 시도
+        start = json_str.find("{")
+        while start >= 0:
+            try:
+                parsed_data, _ = _JSON_DECODER.raw_decode(json_str, start)
+            except json.JSONDecodeError:
+                start = json_str.find("{", start + 1)
+                continue
+            if isinstance(parsed_data, dict):
+                return parsed_data
+            return None
+        return None
+
+    content = content.strip()
+
+    if content.lower() == "none":
+        return None
+
+    if "{" not in content:
+        return None
+
+    # 응답 전체가 JSON 객체인 일반적인 경우는 orjson으로 바로 파싱
+    if content.startswith("{") and content.endswith("}"):
+        try:
+            parsed_data = _json_loads(content)
+        except ValueError:
+            parsed_data = None
+        if isinstance(parsed_data, dict):
+            return parsed_data
+
+    parsed_data = try_decode_json(content)
+    if parsed_data is not None:
+        return parsed_data
+
+    return try_decode_json(content.translate(_SINGLE_TO_DOUBLE))
+
+
+class Filter:
+    class Valves(BaseModel):
+        status: bool = Field(default=True)
+        auto_search_mode: bool = Field(default=False)
+        plan_model: str = Field(default="gpt-4.1-mini")
+        kb_list_cache_ttl: int = Field(default=60)
+        plan_cache_ttl: int = Field(default=600)
+
+    def __init__(self):
+        self.valves = self.Valves()
+        logger.info("Auto Knowledge Selection 필터 초기화됨")
+
+    async def emit_status(
+        self,
+        __event_emitter__: Callable[[dict], Awaitable[None]],
+        level: str,
+        message: str = "",
+        done: bool = False,
+    ):
+        if self.valves.status:
+            await __event_emitter__(
+                {
+                    "type": level,
+                    "data": {
+                        "description": message,
+                        "done": done,
+                    },
+                }
             )
-            + f"\nUser query: {user_message}"
-        )
 
-        return {
-            "system_prompt": system_prompt,
-            "prompt": prompt,
-            "model": self.valves.plan_model,
-        }
+    def use_basic_model(self, body: dict) -> dict:
+        """단순 질문은 Knowledge Base 없이 계획용 기본 모델로 답변하도록 설정"""
+        body["files"] = []
+        body["model"] = self.valves.plan_model
+        basic_model = Models.get_model_by_id(self.valves.plan_model)
+        if "metadata" not in body:
+            body["metadata"] = {}
+        if basic_model:
+            body["metadata"]["model"] = basic_model.model_dump()
+        return body
 
     async def inlet(
         self,
@@ -292,54 +427,90 @@ Return the result in the following JSON format:
         request_id = (
             datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(id(__request__))[-6:]
         )
-        print_log("info", f"[{request_id}] inlet 함수 시작")
+        logger.info("[%s] inlet 함수 시작", request_id)
 
         try:
-            if __user__ is None:
-                user_data = {}
-                user = None
-            else:
-                user_data = __user__.copy()
-                user_data.update(
-                    {
-                        "profile_image_url": "",
-                        "last_active_at": 0,
-                        "updated_at": 0,
-                        "created_at": 0,
-                    }
-                )
-                user = Users.get_user_by_id(__user__["id"])
+            # 0) 명확한 경우는 LLM 없이 단순 질문 여부 판단
+            user_message = get_last_user_message(body["messages"]) or ""
+            local_simple_query = classify_query_locally(user_message, body)
+            if local_simple_query:
+                logger.info("[%s] 인사말로 판단되어 Knowledge Base 선택 과정을 건너뜁니다", request_id)
+                return self.use_basic_model(body)
 
-            user_object = UserModel(**user_data)
+            user = Users.get_user_by_id(__user__["id"]) if __user__ is not None else None
 
-            # 0) 단순 질문 여부 판단
-            print_log("info", f"[{request_id}] 단순 질문 여부 판단 시작")
-            simple_query_plan = await self.determine_simple_query(body, __user__)
-            if simple_query_plan is None:
-                print_log(
-                    "warning",
-                    f"[{request_id}] determine_simple_query 결과가 None입니다",
-                )
-                raise ValueError("determine_simple_query result is None")
-
-            simple_query_payload = {
-                "model": simple_query_plan["model"],
-                "messages": [
-                    {"role": "system", "content": simple_query_plan["system_prompt"]},
-                    {"role": "user", "content": simple_query_plan["prompt"]},
-                ],
-                "stream": False,
-            }
-
-            print_log("info", f"[{request_id}] LLM 호출: 단순 질문 여부 판단")
-            simple_query_response = await generate_chat_completion(
-                request=__request__, form_data=simple_query_payload, user=user
+            # 1) 계획 LLM 호출 (대화 기록은 한 번만 직렬화하여 세 판단에서 공유)
+            history_prompt = build_history_prompt(body["messages"], user_message)
+
+            # 접근 가능한 Knowledge Base가 없으면 선택 LLM 호출 자체를 생략
+            knowledge_bases_list = get_knowledge_bases_list(
+                __user__.get("id"), self.valves.kb_list_cache_ttl
+            )
+            if not knowledge_bases_list:
+                logger.info("[%s] 접근 가능한 Knowledge Base가 없습니다", request_id)
+
+            # 단순 질문 / KB 선택 / 웹 검색 판단별 (system 프롬프트, user 프롬프트), 생략할 판단은 None
+            # 사용자별로 달라지는 KB 목록은 user 메시지에 넣어 system 프롬프트를 고정된 prefix로 유지
+            plans = (
+                (
+                    (_SIMPLE_QUERY_SYSTEM_PROMPT, history_prompt)
+                    if local_simple_query is None
+                    else None
+                ),
+                (
+                    (
+                        _KNOWLEDGE_BASE_SYSTEM_PROMPT,
+                        f"Available knowledge bases:\n{knowledge_bases_list}\n\n{history_prompt}",
+                    )
+                    if knowledge_bases_list
+                    else None
+                ),
+                (
+                    (_WEB_SEARCH_SYSTEM_PROMPT, history_prompt)
+                    if self.valves.auto_search_mode
+                    else None
+                ),
             )
 
-            if simple_query_response is None:
-                print_log(
-                    "warning", f"[{request_id}] simple_query_response가 None입니다"
-                )
+            # 서로 독립적인 세 판단을 동시에 호출하여 대기 시간을 합이 아닌 최댓값으로 줄임
+            logger.info(
+                "[%s] LLM 병렬 호출: 단순 질문 / Knowledge Base 선택 / 웹 검색 판단", request_id
+            )
+            simple_query_response, kb_response, ws_response = await asyncio.gather(
+                *(
+                    (
+                        generate_plan_completion(
+                            __request__,
+                            *plan,
+                            self.valves.plan_model,
+                            user,
+                            self.valves.plan_cache_ttl,
+                        )
+                        if plan is not None
+                        else asyncio.sleep(0, result=None)
+                    )
+                    for plan in plans
+                ),
+                return_exceptions=True,
+            )
+
+            # 각 호출의 실패는 서로에게 영향을 주지 않도록 개별 처리
+            if isinstance(simple_query_response, BaseException):
+                log_error(request_id, simple_query_response)
+                simple_query_response = None
+            if isinstance(kb_response, BaseException):
+                log_error(request_id, kb_response)
+                kb_response = None
+            if isinstance(ws_response, BaseException):
+                log_error(request_id, ws_response)
+                ws_response = None
+
+            # 2) 단순 질문 여부 판단
+            if local_simple_query is False:
+                logger.info("[%s] 단순 질문이 아닌 것이 명확하여 LLM 판단을 생략했습니다", request_id)
+                is_simple_query = False
+            elif simple_query_response is None:
+                logger.warning("[%s] simple_query_response가 None입니다", request_id)
                 is_simple_query = False
             else:
                 simple_query_content = simple_query_response["choices"][0]["message"][
@@ -348,124 +519,63 @@ Return the result in the following JSON format:
                 simple_query_result = parse_json_content(simple_query_content)
 
                 if simple_query_result is None:
-                    print_log(
-                        "warning",
-                        f"[{request_id}] simple_query_result 파싱 결과가 None입니다",
+                    logger.warning(
+                        "[%s] simple_query_result 파싱 결과가 None입니다", request_id
                     )
                     is_simple_query = False
                 else:
                     is_simple_query = simple_query_result.get("is_simple_query", False)
                     reason = simple_query_result.get("reason", "")
-                    print_log(
-                        "info",
-                        f"[{request_id}] 단순 질문 판단 결과: {is_simple_query}, 이유: {reason}",
+                    logger.info(
+                        "[%s] 단순 질문 판단 결과: %s, 이유: %s",
+                        request_id,
+                        is_simple_query,
+                        reason,
                     )
 
             if is_simple_query:
-                print_log(
-                    "info",
-                    f"[{request_id}] 단순 질문으로 판단되어 Knowledge Base 선택 과정을 건너뜁니다",
+                logger.info(
+                    "[%s] 단순 질문으로 판단되어 Knowledge Base 선택 결과를 사용하지 않습니다", request_id
                 )
-                selected_knowledge_bases = []
-                body["files"] = []
-                body["model"] = self.valves.plan_model
-                basic_model = Models.get_model_by_id(self.valves.plan_model)
-                if "metadata" not in body:
-                    body["metadata"] = {}
-                if basic_model:
-                    body["metadata"]["model"] = basic_model.model_dump()
-                return body
+                return self.use_basic_model(body)
+
+            # 3) Knowledge Base 선택
+            if not knowledge_bases_list:
+                kb_content = "None"
+            elif kb_response is None:
+                logger.warning("[%s] kb_response가 None입니다", request_id)
+                kb_content = ""
             else:
-                # 1) Knowledge Base 선택
-                print_log("info", f"[{request_id}] Knowledge Base 선택 시작")
-                kb_plan = await self.select_knowledge_base(body, __user__)
-                if kb_plan is None:
-                    print_log(
-                        "warning",
-                        f"[{request_id}] select_knowledge_base 결과가 None입니다",
-                    )
-                    raise ValueError("select_knowledge_base result is None")
-
-                kb_payload = {
-                    "model": kb_plan["model"],
-                    "messages": [
-                        {"role": "system", "content": kb_plan["system_prompt"]},
-                        {"role": "user", "content": kb_plan["prompt"]},
-                    ],
-                    "stream": False,
-                }
-
-                print_log("info", f"[{request_id}] LLM 호출: Knowledge Base 선택")
-                kb_response = await generate_chat_completion(
-                    request=__request__, form_data=kb_payload, user=user
+                kb_content = (
+                    kb_response["choices"][0]["message"]["content"]
+                    if kb_response
+                    else ""
                 )
 
-                if kb_response is None:
-                    print_log("warning", f"[{request_id}] kb_response가 None입니다")
-                    kb_content = ""
-                else:
-                    kb_content = (
-                        kb_response["choices"][0]["message"]["content"]
-                        if kb_response
-                        else ""
-                    )
-
-                if kb_content == "None":
-                    selected_knowledge_bases = []
-                    print_log(
-                        "info", f"[{request_id}] 선택된 Knowledge Base가 없습니다."
-                    )
-                else:
-                    try:
-                        kb_result = parse_json_content(kb_content)
+            if kb_content == "None":
+                selected_knowledge_bases = []
+                logger.info("[%s] 선택된 Knowledge Base가 없습니다.", request_id)
+            else:
+                try:
+                    kb_result = parse_json_content(kb_content)
 
-                        if kb_result is None:
-                            print_log(
-                                "warning",
-                                f"[{request_id}] kb_result 파싱 결과가 None입니다",
-                            )
-                            selected_knowledge_bases = []
-                        else:
-                            selected_knowledge_bases = kb_result.get(
-                                "selected_knowledge_bases", []
-                            )
-                    except Exception as e:
-                        error_info = traceback.format_exc()
-                        log_error(
-                            request_id,
-                            e,
-                            error_info,
-                            f"파싱 대상 문자열: {kb_content[:200]}...",
-                        )
+                    if kb_result is None:
+                        logger.warning("[%s] kb_result 파싱 결과가 None입니다", request_id)
                         selected_knowledge_bases = []
-
-            # 2) 웹 검색 필요 여부 판단
-            if self.valves.auto_search_mode:
-                print_log("info", f"[{request_id}] 웹 검색 필요 여부 판단 시작")
-                ws_plan = await self.determine_web_search_needed(body, __user__)
-                if ws_plan is None:
-                    print_log(
-                        "warning",
-                        f"[{request_id}] determine_web_search_needed 결과가 None입니다",
+                    else:
+                        selected_knowledge_bases = kb_result.get(
+                            "selected_knowledge_bases", []
+                        )
+                except Exception as e:
+                    log_error(
+                        request_id, e, f"파싱 대상 문자열: {kb_content[:200]}..."
                     )
-                    raise ValueError("determine_web_search_needed result is None")
-
-                ws_payload = {
-                    "model": ws_plan["model"],
-                    "messages": [
-                        {"role": "system", "content": ws_plan["system_prompt"]},
-                        {"role": "user", "content": ws_plan["prompt"]},
-                    ],
-                    "stream": False,
-                }
-
-                print_log("info", f"[{request_id}] LLM 호출: 웹 검색 필요 여부 판단")
-                ws_response = await generate_chat_completion(
-                    request=__request__, form_data=ws_payload, user=user
-                )
+                    selected_knowledge_bases = []
 
+            # 4) 웹 검색 필요 여부 판단
+            if self.valves.auto_search_mode:
                 if ws_response is None:
-                    print_log("warning", f"[{request_id}] ws_response가 None입니다")
+                    logger.warning("[%s] ws_response가 None입니다", request_id)
                     ws_content = ""
                 else:
                     ws_content = (
@@ -477,18 +587,29 @@ Return the result in the following JSON format:
                 ws_result = parse_json_content(ws_content)
 
                 if ws_result is None:
-                    print_log(
-                        "warning", f"[{request_id}] ws_result 파싱 결과가 None입니다"
-                    )
+                    logger.warning("[%s] ws_result 파싱 결과가 None입니다", request_id)
                     web_search_enabled = False
                 else:
                     web_search_enabled = ws_result.get("web_search_enabled", False)
 
                 if isinstance(web_search_enabled, str):
-                    web_search_enabled = web_search_enabled.lower() in ["true", "yes"]
+                    web_search_enabled = (
+                        web_search_enabled.strip().casefold() in _TRUTHY_STRINGS
+                    )
 
                 if web_search_enabled:
-                    print_log("info", f"[{request_id}] 웹 검색 실행")
+                    logger.info("[%s] 웹 검색 실행", request_id)
+                    # 웹 검색을 실제로 실행할 때만 UserModel 생성
+                    user_data = {}
+                    if __user__ is not None:
+                        user_data = {
+                            **__user__,
+                            "profile_image_url": "",
+                            "last_active_at": 0,
+                            "updated_at": 0,
+                            "created_at": 0,
+                        }
+                    user_object = UserModel(**user_data)
                     await chat_web_search_handler(
                         __request__,
                         body,
@@ -496,14 +617,17 @@ Return the result in the following JSON format:
                         user_object,
                     )
                 else:
-                    print_log("info", f"[{request_id}] 웹 검색이 필요하지 않습니다.")
+                    logger.info("[%s] 웹 검색이 필요하지 않습니다.", request_id)
 
-            # 3) Knowledge Base 처리
-            print_log(
-                "info",
-                f"[{request_id}] 선택된 Knowledge Base 처리 시작, 개수: {len(selected_knowledge_bases)}",
+            # 5) Knowledge Base 처리
+            logger.info(
+                "[%s] 선택된 Knowledge Base 처리 시작, 개수: %s",
+                request_id,
+                len(selected_knowledge_bases),
             )
             selected_kb_names = []
+            selected_kb_infos = []
+            all_file_ids = []
             for selected_knowledge_base in selected_knowledge_bases:
                 kb_id = selected_knowledge_base.get("id")
                 kb_name = selected_knowledge_base.get("name")
@@ -517,33 +641,45 @@ Return the result in the following JSON format:
                             not hasattr(selected_knowledge_base_info, "data")
                             or selected_knowledge_base_info.data is None
                         ):
-                            print_log(
-                                "warning",
-                                f"[{request_id}] selected_knowledge_base_info.data가 없거나 None입니다",
+                            logger.warning(
+                                "[%s] selected_knowledge_base_info.data가 없거나 None입니다",
+                                request_id,
                             )
                             continue
 
                         knowledge_file_ids = selected_knowledge_base_info.data.get(
                             "file_ids", []
                         )
-                        knowledge_files = Files.get_file_metadatas_by_ids(
-                            knowledge_file_ids
+                        selected_kb_infos.append(
+                            (selected_knowledge_base_info, knowledge_file_ids)
                         )
-                        knowledge_dict = selected_knowledge_base_info.model_dump()
-                        knowledge_dict["files"] = [
-                            file.model_dump() for file in knowledge_files
-                        ]
-                        knowledge_dict["type"] = "collection"
+                        all_file_ids.extend(knowledge_file_ids)
+
+            # 선택된 모든 Knowledge Base의 파일 메타데이터를 한 번의 DB 조회로 가져옴
+            if selected_kb_infos:
+                files_by_id = {
+                    file.id: file
+                    for file in Files.get_file_metadatas_by_ids(
+                        list(dict.fromkeys(all_file_ids))
+                    )
+                }
+
+                for selected_knowledge_base_info, knowledge_file_ids in selected_kb_infos:
+                    knowledge_dict = selected_knowledge_base_info.model_dump()
+                    knowledge_dict["files"] = [
+                        files_by_id[file_id].model_dump()
+                        for file_id in knowledge_file_ids
+                        if file_id in files_by_id
+                    ]
+                    knowledge_dict["type"] = "collection"
 
-                        if "files" not in body:
-                            body["files"] = []
-                        body["files"].append(knowledge_dict)
+                    if "files" not in body:
+                        body["files"] = []
+                    body["files"].append(knowledge_dict)
 
             if selected_kb_names:
                 kb_names_str = ", ".join(selected_kb_names)
-                print_log(
-                    "info", f"[{request_id}] 선택된 Knowledge Base 이름: {kb_names_str}"
-                )
+                logger.info("[%s] 선택된 Knowledge Base 이름: %s", request_id, kb_names_str)
                 await self.emit_status(
                     __event_emitter__,
                     level="status",
@@ -552,8 +688,7 @@ Return the result in the following JSON format:
                 )
 
         except Exception as e:
-            error_info = traceback.format_exc()
-            log_error(request_id, e, error_info)
+            log_error(request_id, e)
 
             await self.emit_status(
                 __event_emitter__,
@@ -562,48 +697,15 @@ Return the result in the following JSON format:
                 done=True,
             )
 
-        context_message = {
-            "role": "system",
-            "content": (
-                "You are a multidisciplinary expert with contextual adaptation capabilities. You possess deep expertise in the following fields: project management, psychology, economics, design, marketing, and engineering. You are able to use this knowledge in an integrated manner while adapting your approach to the specific needs of each request.\n\n"
-                "The user is seeking high-level expertise to answer their questions or help them with their professional and personal projects. Each request may require a different level of depth, communication style, and analytical framework.\n\n"
-                "Basic Structure for All Responses:\n"
-                "1. Begin by precisely understanding the request, asking clarifying questions if necessary.\n"
-                "2. Adapt your depth level according to the context (quick response or in-depth analysis).\n"
-                "3. Use clear and accessible language, avoiding corporate jargon unless relevant.\n"
-                "4. Check the logical consistency of your response before finalizing it.\n"
-                "5. End with a bullet-point summary of the essential elements to remember.\n\n"
-                "Analytical Approach (to apply as relevant):\n"
-                "- Leverage your interdisciplinary expertise (PM, psychology, economics, design, marketing, engineering).\n"
-                "- Cite relevant references when they strengthen your point (e.g., Ries, 2011; McKinsey, 2021).\n"
-                "- After each analysis, check your logic against recognized theoretical frameworks (Gibson, 2022).\n"
-                "- Highlight any contradictions or tensions in the analysis.\n"
-                "- Use recognized analytical frameworks when appropriate (RICE, OKRs, Double Diamond, etc.).\n"
-                "- Identify potentially problematic assumptions using data or logic.\n\n"
-                "Response Enrichment (to use selectively):\n"
-                "- Illustrate your points with concrete and concise anecdotes.\n"
-                "- Integrate relevant academic knowledge by explaining it simply.\n"
-                "- Propose alternative scenario simulations when it helps decision-making.\n"
-                "- Present the advantages and disadvantages of different options when a decision needs to be made.\n"
-                "- Structure complex points in narrative form to facilitate understanding.\n\n"
-                "Contextual Adaptation:\n"
-                "- Keep in memory the objectives and constraints mentioned previously in the conversation.\n"
-                "- If the user seems stressed, acknowledge it and suggest concrete steps to move forward.\n"
-                "- Maintain consistency in the terminology used unless requested otherwise.\n"
-                "- Follow a continuous improvement process by taking into account user feedback.\n"
-                "- Keep track of recurring topics to allow for further exploration later.\n\n"
-                "Output Format:\n"
-                "1. A direct answer to the main question\n"
-                "2. A structured analysis using relevant techniques\n"
-                "3. Concrete examples or illustrations if appropriate\n"
-                "4. A final bullet-point summary\n"
-                "5. Follow-up or further exploration suggestions if relevant\n\n"
-                "**IMPORTANT: Additionally, please respond in the language used by the user in their input.**\n\n"
-            ),
-        }
-
-        body.setdefault("messages", []).insert(0, context_message)
-        print_log("info", f"[{request_id}] inlet 함수 종료")
+        messages = body.setdefault("messages", [])
+        if not (
+            messages
+            and messages[0].get("role") == "system"
+            and messages[0].get("content") == _CONTEXT_SYSTEM_CONTENT
+        ):
+            # 이후 미들웨어가 system 메시지 내용을 수정할 수 있으므로 복사본을 삽입
+            messages.insert(0, dict(_CONTEXT_MESSAGE))
+        logger.info("[%s] inlet 함수 종료", request_id)
 
         await self.emit_status(
             __event_emitter__,
@@ -5,24 +5,516 @@ date: 2024-06-01
 version: 1.0
 license: MIT
 description: Filter that connects Open-WebUI to Open-Search-Agent API for enhanced web search capabilities
-requirements: requests
+requirements: httpx[http2], orjson
 """
 
+from contextlib import suppress
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from pydantic import BaseModel, Field
-from typing import Callable, Awaitable, Any, List
-import json
+from typing import (
+    Callable,
+    Awaitable,
+    Any,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    TypedDict,
+)
+import asyncio
+import atexit
+import hashlib
 import httpx
-from datetime import datetime
-import traceback
+import json
+import logging
+import math
+import operator
+import re
+import sys
+import time
+
+try:
+    from orjson import dumps as _orjson_dumps, loads as _json_loads
+
+    def _json_dumps(obj: Any) -> str:
+        """공백 없는 JSON 문자열로 직렬화 (orjson은 기본이 compact/UTF-8)"""
+        return _orjson_dumps(obj).decode()
+
+except ImportError:
+    from json import loads as _json_loads
+
+    def _json_dumps(obj: Any) -> str:
+        """공백 없는 JSON 문자열로 직렬화"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+# 콘솔 로거 (비활성화된 레벨의 메시지는 포맷팅 비용 없이 무시됨)
+logger = logging.getLogger("open_search_agent")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(
+        logging.Formatter(
+            "[%(asctime)s] [%(levelname)s] [Open Search Agent] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+    )
+    # stdout 쓰기는 별도 스레드에서 처리해 이벤트 루프가 출력을 기다리지 않게 한다
+    _log_queue = SimpleQueue()
+    _log_listener = QueueListener(_log_queue, _log_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    logger.addHandler(QueueHandler(_log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+async def _emit_worker(event_emitter, queue: asyncio.Queue):
+    """큐에 쌓인 이벤트를 순서대로 클라이언트에 전달하는 함수 (None을 받으면 종료)"""
+    while True:
+        event = await queue.get()
+        if event is None:
+            break
+        try:
+            await event_emitter(event)
+        except Exception as e:
+            logger.error("Error emitting event: %s", str(e))
+
+
+async def _read_lines(response: httpx.Response, line_queue: asyncio.Queue):
+    """응답 바이트를 줄 단위로 잘라 큐에 넣는 함수 (끝나면 None을 넣는다)"""
+    try:
+        # 새로 들어온 부분만 줄바꿈을 찾고, 디코딩은 JSON 파서에 맡긴다
+        buf = bytearray()
+        scan = 0
+        find_newline = buf.find
+        async for chunk in response.aiter_bytes():
+            buf += chunk
+            while True:
+                idx = find_newline(b"\n", scan)
+                if idx == -1:
+                    scan = len(buf)
+                    break
+
+                line = buf[:idx].strip()
+                del buf[: idx + 1]
+                scan = 0
+                if line:
+                    await line_queue.put(line)
+    except Exception:
+        await line_queue.put(None)
+        raise
+    await line_queue.put(None)
+
+
+def _last_user_message(messages: List[dict]) -> Optional[str]:
+    """마지막 사용자 메시지의 텍스트를 뒤에서부터 찾아 반환 (멀티모달이면 첫 텍스트 부분)"""
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, list):
+            return next(
+                (part.get("text") for part in content if part.get("type") == "text"),
+                None,
+            )
+        return content
+    return None
+
+
+def _truncated_repr(data: dict, limit: int) -> str:
+    """전체 직렬화 없이 앞쪽 항목만으로 limit 길이의 미리보기를 만드는 함수"""
+    parts = []
+    size = 0
+    for key, value in data.items():
+        part = f"{key}={value!r:.20}"
+        parts.append(part)
+        size += len(part) + 1
+        if size >= limit:
+            break
+    return " ".join(parts)[:limit]
+
+
+def _ellipsize(text: str, limit: int = 50) -> str:
+    """limit 글자를 넘을 때만 잘라서 '...'을 붙이는 함수"""
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
+
+# 검색 결과 시스템 메시지 템플릿 조각 (호출마다 f-string을 다시 만들지 않도록 미리 나눠 둠)
+_SYS_PREFIX = """
+다음은 Open Search Agent를 통해 검색한 결과입니다. 이 정보를 바탕으로 사용자의 질문에 답변해주세요.
+
+# 사용자 질문
+"""
+_SYS_QUERIES = """
+
+# 검색 쿼리 및 결과
+"""
+_SYS_SOURCES = """
+
+# 검색 소스
+"""
+_SYS_SUFFIX = """
+
+위 정보를 바탕으로 사용자의 질문에 상세하게 답변해주세요. 소스 정보를 인용하고 출처를 명시해주세요.
+답변은 사용자가 이해하기 쉽게 구조화하고, 필요한 경우 마크다운 형식을 사용하여 가독성을 높여주세요.
+"""
+
+
+def _format_sources(sources: List[dict], sources_format: str) -> str:
+    """폴백 시스템 메시지에 넣을 검색 소스 텍스트를 만드는 함수"""
+    if sources_format == "bulleted":
+        return "\n".join(
+            f"- [{source.get('title', '제목 없음')}]({source.get('link', '#')})"
+            for source in sources
+        )
+    if sources_format == "compact_json":
+        return _json_dumps(sources)
+
+    # Format sources in a more readable way
+    # 중간 문자열 없이 조각을 한 목록에 모아 마지막에 한 번만 합친다
+    parts = []
+    extend = parts.extend
+    for i, source in enumerate(sources, 1):
+        extend(
+            (
+                "\n[" if i > 1 else "[",
+                str(i),
+                "] ",
+                source.get("title", "제목 없음"),
+                "\n링크: ",
+                source.get("link", "#"),
+                "\n내용: ",
+                # Truncate content if too long
+                _ellipsize(source.get("content", "내용 없음"), 500),
+                "\n",
+            )
+        )
+
+    return "".join(parts)
+
+
+# 보고서 청크 이벤트와 해당 상태 메시지의 최소 전송 간격 (초)
+_REPORT_EVENTS = frozenset(("report_chunk", "report"))
+_REPORT_STATUS_INTERVAL = 0.25
+
+# 전달 대기 중인 이벤트가 이만큼 쌓이면 클라이언트가 느린 것으로 보고 진행 상태를 버린다
+_STATUS_DROP_BACKLOG = 8
+
+# 보고서 청크를 모아 보내는 기준 (글자 수, 초)
+_REPORT_FLUSH_SIZE = 1024
+_REPORT_FLUSH_INTERVAL = 0.05
+
+# 웹 검색이 필요 없는 인사/감사 인사만으로 이루어진 메시지
+# ("계속", "네" 같은 짧은 답도 앞 대화에 이어지는 검색일 수 있으므로 넣지 않는다)
+_TRIVIAL_MESSAGE_PATTERN = re.compile(
+    r"^\s*(안녕하세요|안녕|고마워요|고마워|감사합니다|hi|hello|hey|thanks|thank you)[\s!.?~]*$",
+    re.I,
+)
+
+# 업스트림 슬롯을 이 시간(초) 이상 기다리면 사용자에게 대기 상태를 알린다
+_QUEUE_WAIT_NOTICE = 1.0
+
+
+# 프롬프트별 검색 결과 캐시: {키: (만료 시각, (신선 기한, (결과, 클라이언트에 보낸 이벤트 목록)))}
+_search_cache: dict = {}
+
+# 비슷한 프롬프트용 의미 캐시: [(만료 시각, API URL, 정규화된 임베딩, 캐시 값)]
+_semantic_cache: list = []
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    """코사인 유사도를 내적으로 구할 수 있도록 벡터를 단위 길이로 맞추는 함수"""
+    norm = math.sqrt(sum(map(operator.mul, vector, vector)))
+    return [x / norm for x in vector] if norm else vector
+
+
+def semantic_cache_get(api_url: str, vector: List[float], threshold: float) -> Any:
+    """유사도가 threshold 이상인 가장 가까운 캐시 값을 반환 (없으면 None)"""
+    now = time.monotonic()
+    # 만료된 항목은 조회하면서 함께 정리한다
+    _semantic_cache[:] = [entry for entry in _semantic_cache if entry[0] > now]
+    best, best_score = None, threshold
+    for _, url, cached_vector, value in _semantic_cache:
+        if url != api_url or len(cached_vector) != len(vector):
+            continue
+        score = sum(map(operator.mul, cached_vector, vector))
+        if score >= best_score:
+            best, best_score = value, score
+    return best
+
+
+def semantic_cache_put(
+    api_url: str, vector: List[float], value: Any, ttl: int, maxsize: int
+):
+    """의미 캐시에 값을 저장 (가득 차면 가장 오래된 항목부터 제거)"""
+    if ttl <= 0 or maxsize <= 0:
+        return
+    if len(_semantic_cache) >= maxsize:
+        del _semantic_cache[: len(_semantic_cache) - maxsize + 1]
+    _semantic_cache.append((time.monotonic() + ttl, api_url, vector, value))
+
+
+def cache_get(cache: dict, key: Any) -> Any:
+    """TTL 캐시에서 만료되지 않은 값을 반환 (없거나 만료되면 None)"""
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    if cached[0] <= time.monotonic():
+        cache.pop(key, None)
+        return None
+    return cached[1]
+
 
-from open_webui.utils.misc import get_last_user_message
+def cache_put(cache: dict, key: Any, value: Any, ttl: int, maxsize: int):
+    """TTL 캐시에 값을 저장 (ttl이 0 이하이면 저장하지 않음)"""
+    if ttl <= 0:
+        return
+    if key not in cache and len(cache) >= maxsize:
+        # 가장 오래된 항목부터 제거
+        cache.pop(next(iter(cache)))
+    cache[key] = (time.monotonic() + ttl, value)
 
 
-# 유틸리티 함수
-def print_log(level: str, message: str):
-    """로그를 출력하는 함수"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] [{level.upper()}] [Open Search Agent] {message}")
+# 이벤트마다 다시 만들 필요 없는 고정 문구
+_REPORT_STATUS_MESSAGE = "보고서 생성 중... (실시간으로 표시됩니다)"
+_SEARCH_COMPLETE_DELTA = "\n\n---\n\n**검색 및 보고서 생성이 완료되었습니다.**"
+
+
+# 채팅 화면에 그대로 넣는 외부 텍스트의 HTML 태그를 무력화하는 변환 테이블
+_MD_ESCAPE = str.maketrans({"<": "&lt;", ">": "&gt;"})
+
+# 마크다운 링크로 허용하는 주소 형식
+_SAFE_LINK_PREFIXES = ("http://", "https://", "#")
+
+
+def _safe_link(link: str) -> str:
+    """http(s) 주소나 앵커가 아니면 링크를 '#'으로 바꾸는 함수"""
+    return link if link.startswith(_SAFE_LINK_PREFIXES) else "#"
+
+
+# 이벤트 유형별 상태 메시지 포맷터
+_MSG_FORMATTERS = {
+    "search_start": lambda d: f"검색 시작: {_ellipsize(d.get('prompt', ''))}",
+    "decomposed_queries": lambda d: f"검색 쿼리 분해: {len(d.get('queries', []))}개의 쿼리로 분해됨",
+    "search_query": lambda d: f"검색 중: {d.get('query', '')}",
+    "search_results": lambda d: f"검색 결과: {d.get('query', '')}에 대해 {d.get('count', 0)}개 결과 발견",
+    "summarize_progress": lambda d: f"요약 중: {d.get('query', '')}의 결과 {d.get('current', 0)}/{d.get('total', 0)}",
+    "summarize_complete": lambda d: f"요약 완료: {d.get('query', '')}의 {d.get('count', 0)}개 결과",
+    "summarized_result": lambda d: f"요약 결과: {d.get('query', '')}의 {d.get('index', 0)}/{d.get('total', 0)} 번째 결과",
+    "evaluation": lambda d: f"평가: {d.get('query', '')}는 {'충분함' if d.get('sufficient', False) else '불충분함'}",
+    "report_chunk": lambda d: _REPORT_STATUS_MESSAGE,
+    "report": lambda d: _REPORT_STATUS_MESSAGE,
+    "sources": lambda d: f"소스 정보: {len(d.get('sources', []))}개 소스 발견",
+    "search_complete": lambda d: "검색 및 보고서 생성 완료",
+    "error": lambda d: f"오류: {d.get('message', '')}",
+}
+
+
+# 스트림 이벤트 페이로드 타입
+class StreamEvent(TypedDict, total=False):
+    event: str
+    data: dict
+
+
+class SearchResultsData(TypedDict, total=False):
+    query: str
+    count: int
+    results: list
+    additional: bool
+
+
+class SummarizedResultData(TypedDict, total=False):
+    query: str
+    index: int
+    total: int
+    original_result: dict
+    summarized_result: dict
+
+
+class EvaluationData(TypedDict, total=False):
+    query: str
+    sufficient: bool
+    results: list
+    reasoning: str
+
+
+class ReportChunkData(TypedDict, total=False):
+    content: str
+
+
+class SourcesData(TypedDict, total=False):
+    sources: List[dict]
+
+
+# 클라이언트로 보내는 이벤트 생성 함수
+def _message_delta(content: str) -> dict:
+    """채팅 메시지에 내용을 덧붙이는 chat:message:delta 이벤트를 만드는 함수"""
+    return {"type": "chat:message:delta", "data": {"content": content}}
+
+
+def _status_event(description: str, done: bool = False) -> dict:
+    """상태 표시줄을 갱신하는 status 이벤트를 만드는 함수"""
+    return {"type": "status", "data": {"description": description, "done": done}}
+
+
+# 이벤트 유형별 처리 함수
+async def _on_search_start(final_results: dict, data: dict, event_emitter):
+    logger.info("Search started for: %s", data.get("prompt"))
+
+
+async def _on_decomposed_queries(final_results: dict, data: dict, event_emitter):
+    logger.info("Decomposed into %s queries", len(data.get("queries", [])))
+
+
+async def _on_search_query(final_results: dict, data: dict, event_emitter):
+    logger.info("Searching for: %s", data.get("query", ""))
+
+
+async def _on_search_results(
+    final_results: dict, data: SearchResultsData, event_emitter
+):
+    logger.info(
+        "Found %s results for: %s", data.get("count", 0), data.get("query", "")
+    )
+    await event_emitter(
+        {
+            "type": "status",
+            "data": {
+                "action": "thinking",
+                "description": "AI is thinking...",
+                "done": False,
+            },
+        }
+    )
+
+
+async def _on_summarized_result(
+    final_results: dict, data: SummarizedResultData, event_emitter
+):
+    # 업스트림이 명시적으로 null을 보내도 기본값으로 대체 (.get 기본값은 키가 없을 때만 적용됨)
+    original_result = data.get("original_result") or {}
+    summarized_result = data.get("summarized_result") or {}
+    title = (original_result.get("title") or "제목 없음").translate(_MD_ESCAPE)
+    link = _safe_link(original_result.get("link") or "#")
+    content = (summarized_result.get("content") or "").translate(_MD_ESCAPE)
+    relevance = (summarized_result.get("relevance") or "알 수 없음").translate(_MD_ESCAPE)
+
+    # Format the summarized result for display (trailing blank lines included)
+    summary_message = (
+        f"### 검색 결과 요약 ({data.get('index', 0)}/{data.get('total', 0)})\n\n"
+        f"**원본:** [{title}]({link})\n\n"
+        f"**요약:**\n{content}\n\n"
+        f"**관련성:** {relevance}\n\n\n\n"
+    )
+
+    # Stream the summarized result to the UI using chat:message:delta
+    await event_emitter(_message_delta(summary_message))
+
+
+async def _on_evaluation(final_results: dict, data: EvaluationData, event_emitter):
+    query = data.get("query") or ""
+    sufficient = data.get("sufficient", False)
+    reasoning = data.get("reasoning") or ""
+    logger.info(
+        "Evaluation for %s: %s", query, "Sufficient" if sufficient else "Insufficient"
+    )
+
+    # Add to search steps
+    final_results["search_steps"].append(
+        {
+            "query": query,
+            "results": data.get("results", []),
+            "sufficient": sufficient,
+            "reasoning": reasoning,
+        }
+    )
+
+    # Format the evaluation result for display (trailing blank lines included)
+    eval_message = (
+        f"### 검색 결과 평가: {query.translate(_MD_ESCAPE)}\n\n"
+        f"**결과:** {'충분함 ✅' if sufficient else '불충분함 ❌'}\n\n"
+        f"**이유:**\n{reasoning.translate(_MD_ESCAPE)}\n\n\n\n"
+    )
+
+    # Stream the evaluation result to the UI using chat:message:delta
+    await event_emitter(_message_delta(eval_message))
+
+
+async def _on_report_chunk(final_results: dict, data: ReportChunkData, event_emitter):
+    # Process report chunks and display them in real-time
+    content = data.get("content", "")
+    logger.info("Received report chunk: %s characters", len(content))
+
+    # Append to the final report (joined once the stream ends)
+    # UI 전달은 스트림 루프에서 여러 청크를 모아 한 번에 한다
+    final_results["final_report"].append(content)
+
+
+async def _on_sources(final_results: dict, data: SourcesData, event_emitter):
+    sources = final_results["sources"] = data.get("sources", [])
+    logger.info("Received %s sources", len(sources))
+
+
+async def _on_search_complete(final_results: dict, data: dict, event_emitter):
+    logger.info("Search and report generation completed")
+
+    # Send a completion message
+    await event_emitter(_message_delta(_SEARCH_COMPLETE_DELTA))
+
+    # Mark the assistant message as complete
+    await event_emitter(
+        {
+            "type": "assistant",
+            "data": {
+                "content": "",  # Empty content as we've already streamed the report
+                "done": True,
+            },
+        }
+    )
+
+
+_STATE_HANDLERS = {
+    "search_start": _on_search_start,
+    "decomposed_queries": _on_decomposed_queries,
+    "search_query": _on_search_query,
+    "search_results": _on_search_results,
+    "summarized_result": _on_summarized_result,
+    "evaluation": _on_evaluation,
+    "report_chunk": _on_report_chunk,
+    "report": _on_report_chunk,
+    "sources": _on_sources,
+    "search_complete": _on_search_complete,
+}
+
+# 이벤트 유형별 (포맷터, 처리 함수) 묶음: 이벤트마다 한 번의 조회로 둘 다 얻는다
+_EVENT_DISPATCH = {
+    event_type: (_MSG_FORMATTERS.get(event_type), _STATE_HANDLERS.get(event_type))
+    for event_type in _MSG_FORMATTERS.keys() | _STATE_HANDLERS.keys()
+}
+_NO_DISPATCH = (None, None)
+
+
+# 요청 처리 중 읽는 밸브 값의 불변 스냅샷
+class _ValveSnapshot(NamedTuple):
+    status: bool
+    show_status: bool
+    skip_trivial_messages: bool
+    min_prompt_chars: int
+    api_url: str
+    api_key: str
+    sources_format: str
+    max_sources_in_prompt: int
+    max_concurrent_upstream: int
+    cache_ttl: int
+    cache_max_entries: int
+    cache_stale_ttl: int
+    semantic_cache_enabled: bool
+    semantic_cache_threshold: float
+    embedding_url: str
+    embedding_model: str
+    max_report_chars: int
+    max_search_steps: int
 
 
 class Filter:
@@ -42,6 +534,78 @@ class Filter:
 
         # Enable/disable the filter
         status: bool = Field(default=True)
+        # Show status messages while searching (the search itself still runs when off)
+        show_status: bool = Field(default=True)
+
+        # Pass through greetings, thanks and messages shorter than
+        # min_prompt_chars without calling the search API
+        # (short Korean queries such as "환율" or "날씨" are still searched)
+        skip_trivial_messages: bool = Field(default=True)
+        min_prompt_chars: int = Field(default=2)
+
+        # Format of the sources section when no final report is available
+        # - detailed: title, link and up to 500 characters of content
+        #   (most context, most tokens)
+        # - bulleted: Markdown title/link list only (fewest tokens, enough to cite)
+        # - compact_json: whitespace-free JSON of the raw source objects
+        sources_format: Literal["detailed", "bulleted", "compact_json"] = Field(
+            default="detailed"
+        )
+        # Maximum number of sources put into that section (upstream order is kept)
+        max_sources_in_prompt: int = Field(default=20)
+
+        # Maximum number of simultaneous upstream search streams; extra calls wait
+        max_concurrent_upstream: int = Field(default=8)
+
+        # Seconds to reuse the result of an identical prompt (0 disables the cache)
+        cache_ttl: int = Field(default=300)
+        # Maximum number of cached search results (oldest entries are evicted first)
+        cache_max_entries: int = Field(default=256)
+        # Extra seconds an expired result is still served while it is refreshed
+        # in the background (stale-while-revalidate; 0 disables)
+        cache_stale_ttl: int = Field(default=0)
+
+        # Also reuse results of similar (paraphrased) prompts by embedding similarity
+        # Requires an Ollama-compatible /api/embed endpoint; uses cache_ttl and
+        # cache_max_entries
+        semantic_cache_enabled: bool = Field(default=False)
+        semantic_cache_threshold: float = Field(default=0.92)
+        embedding_url: str = Field(default="http://localhost:11434/api/embed")
+        embedding_model: str = Field(default="nomic-embed-text")
+
+        # Upper bounds for one search stream (report length in characters, number of
+        # search steps); the stream is aborted when exceeded
+        max_report_chars: int = Field(default=2_000_000)
+        max_search_steps: int = Field(default=128)
+
+    @property
+    def valves(self) -> "Filter.Valves":
+        return self._valves
+
+    @valves.setter
+    def valves(self, valves: "Filter.Valves"):
+        # Open WebUI는 밸브 저장 시 객체를 통째로 교체하므로, 이때 핫 패스용 스냅샷도 갱신한다
+        self._valves = valves
+        self._v = _ValveSnapshot(
+            status=valves.status,
+            show_status=valves.show_status,
+            skip_trivial_messages=valves.skip_trivial_messages,
+            min_prompt_chars=valves.min_prompt_chars,
+            api_url=valves.api_url,
+            api_key=valves.api_key,
+            sources_format=valves.sources_format,
+            max_sources_in_prompt=valves.max_sources_in_prompt,
+            max_concurrent_upstream=valves.max_concurrent_upstream,
+            cache_ttl=valves.cache_ttl,
+            cache_max_entries=valves.cache_max_entries,
+            cache_stale_ttl=valves.cache_stale_ttl,
+            semantic_cache_enabled=valves.semantic_cache_enabled,
+            semantic_cache_threshold=valves.semantic_cache_threshold,
+            embedding_url=valves.embedding_url,
+            embedding_model=valves.embedding_model,
+            max_report_chars=valves.max_report_chars,
+            max_search_steps=valves.max_search_steps,
+        )
 
     def __init__(self):
         # Pipeline filters are only compatible with Open WebUI
@@ -53,15 +617,87 @@ class Filter:
         # Initialize valves
         self.valves = self.Valves()
 
-        print_log("info", f"Filter initialized with API URL: {self.valves.api_url}")
+        # 요청 간에 연결을 재사용하는 공유 httpx 클라이언트 (처음 사용할 때 생성)
+        self._client = None
+        self._client_config = None
+        self._embedding_client = None
+
+        # 업스트림 동시 호출 제한용 세마포어 (이벤트 루프 안에서 처음 사용할 때 생성)
+        self._semaphore = None
+        self._semaphore_limit = None
+
+        # 진행 중인 검색: {프롬프트 키: (결과, 이벤트 목록)을 받을 Future}
+        self._inflight: dict = {}
+        # 백그라운드 재검증 작업: {프롬프트 키: 작업} (작업 참조 유지와 중복 방지용)
+        self._revalidations: dict = {}
+
+        logger.info("Filter initialized with API URL: %s", self.valves.api_url)
 
     async def on_startup(self):
         # This function is called when the server is started
-        print_log("info", "Filter started")
+        logger.info("Filter started")
 
     async def on_shutdown(self):
         # This function is called when the server is stopped
-        print_log("info", "Filter stopped")
+        for task in list(self._revalidations.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._embedding_client is not None:
+            await self._embedding_client.aclose()
+            self._embedding_client = None
+        logger.info("Filter stopped")
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """업스트림 동시 호출 수를 제한하는 세마포어를 반환하는 함수 (밸브 값이 바뀌면 다시 만든다)"""
+        limit = max(1, self._v.max_concurrent_upstream)
+        if self._semaphore is None or self._semaphore_limit != limit:
+            self._semaphore = asyncio.Semaphore(limit)
+            self._semaphore_limit = limit
+        return self._semaphore
+
+    def _get_client(self, api_key: str) -> httpx.AsyncClient:
+        """API URL과 키별로 공유 httpx 클라이언트를 반환하는 함수"""
+        config = (self._v.api_url, api_key)
+        if (
+            self._client is None
+            or self._client.is_closed
+            or self._client_config != config
+        ):
+            # 설정이 바뀌면 새 클라이언트를 만든다 (진행 중인 스트림은 이전 클라이언트로 끝까지 읽는다)
+            self._client = httpx.AsyncClient(
+                base_url=self._v.api_url,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {api_key}",
+                },
+                # 스트림 읽기는 무제한으로 두고, 연결이 안 되는 경우에만 빨리 실패한다
+                timeout=httpx.Timeout(None, connect=10.0),
+                http2=True,  # 서버가 h2를 지원하면 하나의 연결로 요청을 다중화한다
+                limits=httpx.Limits(
+                    max_keepalive_connections=32,
+                    max_connections=64,
+                    keepalive_expiry=60,
+                ),
+            )
+            self._client_config = config
+        return self._client
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        """의미 캐시용 임베딩을 구하는 함수 (실패하면 None을 반환해 캐시 없이 진행)"""
+        if self._embedding_client is None or self._embedding_client.is_closed:
+            self._embedding_client = httpx.AsyncClient(timeout=httpx.Timeout(10.0))
+        try:
+            response = await self._embedding_client.post(
+                self._v.embedding_url,
+                json={"model": self._v.embedding_model, "input": text},
+            )
+            response.raise_for_status()
+            return _normalize(_json_loads(response.content)["embeddings"][0])
+        except Exception as e:
+            logger.warning("Embedding request failed: %s", e)
+            return None
 
     async def emit_status(
         self,
@@ -71,7 +707,7 @@ class Filter:
         done: bool = False,
     ):
         """Send status updates to the client"""
-        if self.valves.status:
+        if self._v.show_status:
             await __event_emitter__(
                 {
                     "type": level,
@@ -83,360 +719,407 @@ class Filter:
             )
 
     async def call_open_search_agent(
-        self, prompt: str, api_key: str, event_emitter=None
+        self, prompt: str, api_key: str, event_emitter=None, use_cache: bool = True
     ) -> dict:
         """
         Call the Open-Search-Agent API to process a search query
 
-        This function uses different endpoints based on whether streaming is needed:
-        - Non-streaming: /search/results endpoint
-        - Streaming: /search/stream endpoint
-
-        The streaming endpoint provides real-time updates including search results and report generation.
-        This allows the UI to display both the search process and the final report in real-time.
+        Both modes read the /search/stream endpoint, which provides real-time updates
+        including search results and report generation. With an event emitter the UI
+        displays the search process and the final report in real-time; without one the
+        events are only collected into the returned results.
 
         Args:
             prompt: The search query
             api_key: The API key for authentication
             event_emitter: Optional function to emit events to the client
+            use_cache: Whether to read and store the result in the search cache
 
         Returns:
             The search results and report as a dictionary
         """
+        # 같은 프롬프트의 최근 결과가 있으면 업스트림 호출 없이 이벤트를 다시 보낸다
+        key = hashlib.blake2b(
+            f"{self._v.api_url}|{prompt}".encode(), digest_size=16
+        ).hexdigest()
+        cache_key = None
+        if use_cache and self._v.cache_ttl > 0 and self._v.cache_max_entries > 0:
+            cache_key = key
+            entry = cache_get(_search_cache, cache_key)
+            if entry is not None:
+                fresh_until, cached = entry
+                if fresh_until > time.monotonic():
+                    logger.info("Search cache hit for: %s", prompt)
+                elif key not in self._inflight and key not in self._revalidations:
+                    # 신선도가 지난 결과는 바로 보내고, 백그라운드에서 다시 검색해 캐시를 갱신한다
+                    logger.info("Serving stale result and revalidating: %s", prompt)
+                    task = asyncio.create_task(
+                        self._revalidate(key, prompt, api_key, cache_key)
+                    )
+                    self._revalidations[key] = task
+                    task.add_done_callback(
+                        lambda _: self._revalidations.pop(key, None)
+                    )
+                return await self._replay_cached(cached, event_emitter, self._v.show_status)
+
+        # 비슷한 프롬프트의 결과가 있으면 그것을 재사용한다
+        vector = None
+        if cache_key is not None and self._v.semantic_cache_enabled:
+            vector = await self._embed(prompt)
+            if vector is not None:
+                cached = semantic_cache_get(
+                    self._v.api_url, vector, self._v.semantic_cache_threshold
+                )
+                if cached is not None:
+                    logger.info("Semantic cache hit for: %s", prompt)
+                    return await self._replay_cached(cached, event_emitter, self._v.show_status)
+
+        # 같은 프롬프트의 검색이 이미 진행 중이면 새로 호출하지 않고 그 결과를 기다린다
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            logger.info("Joining in-flight search for: %s", prompt)
+            if event_emitter is not None:
+                await self.emit_status(
+                    event_emitter,
+                    level="status",
+                    message="Open Search Agent: 같은 검색이 진행 중이라 결과를 기다리는 중",
+                )
+            try:
+                # 기다리던 쪽이 취소되어도 공유 Future는 취소되지 않게 한다
+                shared = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # 먼저 시작한 호출이 취소되었으면 직접 검색한다
+                return await self.call_open_search_agent(
+                    prompt, api_key, event_emitter, use_cache
+                )
+            return await self._replay_cached(shared, event_emitter, self._v.show_status)
+
+        return await self._fetch(key, prompt, api_key, event_emitter, cache_key, vector)
+
+    async def _fetch(
+        self,
+        key: str,
+        prompt: str,
+        api_key: str,
+        event_emitter,
+        cache_key: Optional[str],
+        vector: Optional[List[float]],
+    ) -> dict:
+        """업스트림에서 검색해 진행 중인 같은 요청과 결과를 공유하고, 성공한 결과를 캐시하는 함수"""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
         try:
-            # If no event emitter is provided, use the non-streaming search results endpoint
-            if event_emitter is None:
-                async with httpx.AsyncClient(timeout=None) as client:
-                    headers = {
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {api_key}",
-                    }
-
-                    # Call the search results endpoint (without final report)
-                    response = await client.post(
-                        f"{self.valves.api_url}/search/results",
-                        headers=headers,
-                        json={"prompt": prompt},
+            results, events = await self._search_upstream(
+                prompt, api_key, event_emitter
+            )
+            future.set_result((results, events))
+        finally:
+            # 그사이 같은 키로 다른 검색이 등록되었을 수 있으므로 자기 항목일 때만 지운다
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if not future.done():
+                future.cancel()
+
+        # 오류가 없고 보고서가 만들어진 결과만 캐시한다
+        if (
+            cache_key is not None
+            and "error" not in results
+            and results.get("final_report")
+        ):
+            # 신선 기간이 지나도 cache_stale_ttl 동안은 남겨 두고 재검증에 사용한다
+            cache_put(
+                _search_cache,
+                cache_key,
+                (time.monotonic() + self._v.cache_ttl, (results, events)),
+                self._v.cache_ttl + max(0, self._v.cache_stale_ttl),
+                self._v.cache_max_entries,
+            )
+            if vector is not None:
+                semantic_cache_put(
+                    self._v.api_url,
+                    vector,
+                    (results, events),
+                    self._v.cache_ttl,
+                    self._v.cache_max_entries,
+                )
+        return results
+
+    async def _revalidate(self, key: str, prompt: str, api_key: str, cache_key: str):
+        """오래된 캐시 결과를 백그라운드에서 다시 검색해 갱신하는 함수 (실패하면 기존 결과 유지)"""
+        try:
+            await self._fetch(key, prompt, api_key, None, cache_key, None)
+        except Exception as e:
+            logger.warning("Background revalidation failed for %s: %s", prompt, e)
+
+    async def _search_upstream(
+        self, prompt: str, api_key: str, event_emitter
+    ) -> tuple:
+        """업스트림 슬롯을 얻어 검색하고 (결과, 클라이언트에 보낸 이벤트 목록)을 반환하는 함수"""
+        # 업스트림 동시 스트림 수를 제한해 초과 요청은 몰려들지 않고 순서대로 기다린다
+        semaphore = self._get_semaphore()
+        wait_started = time.monotonic()
+        async with semaphore:
+            queue_wait = time.monotonic() - wait_started
+            if queue_wait >= _QUEUE_WAIT_NOTICE:
+                logger.info("Waited %.1fs for an upstream slot", queue_wait)
+                if event_emitter is not None:
+                    await self.emit_status(
+                        event_emitter,
+                        level="status",
+                        message=f"Open Search Agent: 요청이 많아 {queue_wait:.1f}초 대기함",
                     )
+            events: List[dict] = []
+            results = await self._stream_search(prompt, api_key, event_emitter, events)
+        return results, events
+
+    @staticmethod
+    async def _replay_cached(cached: tuple, event_emitter, send_status: bool) -> dict:
+        """캐시된 결과를 반환하고, 검색 당시 기록한 이벤트를 다시 보내는 함수"""
+        results, events = cached
+        if event_emitter is not None:
+            for event in events:
+                if send_status or event["type"] != "status":
+                    await event_emitter(event)
+        return results
+
+    async def _stream_search(
+        self, prompt: str, api_key: str, event_emitter, events: List[dict]
+    ) -> dict:
+        """/search/stream 응답을 읽어 최종 결과로 모으는 함수 (클라이언트에 보낸 이벤트는 events에 기록)"""
+        try:
+            # Final results to return
+            report_parts: List[str] = []
+            final_results = {
+                "original_prompt": prompt,
+                "search_steps": [],
+                "sources": [],
+                "final_report": report_parts,  # 스트림 종료 후 한 번에 합친다
+            }
+
+            client = self._get_client(api_key)
+
+            # Call the streaming endpoint (with search results and final report)
+            # 이벤트 전달은 백그라운드 작업에 맡겨 느린 클라이언트가 스트림 읽기를 막지 않게 한다
+            emit_queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+            emit_worker = None
+            if event_emitter is not None:
+                emit_worker = asyncio.create_task(
+                    _emit_worker(event_emitter, emit_queue)
+                )
 
-                    if response.status_code == 200:
-                        return response.json()
-                    else:
-                        print_log(
-                            "error",
-                            f"API error: {response.status_code} - {response.text}",
+            status_enabled = self._v.show_status
+
+            async def emit(event: dict):
+                # 캐시 적중 시 다시 보낼 수 있도록 모든 이벤트를 기록한다
+                # (백그라운드 재검증처럼 에미터가 없거나 상태 표시가 꺼져 있어도 기록해야 재생 결과가 같다)
+                events.append(event)
+
+                # 이벤트 에미터가 없으면 결과만 모으고 전달은 하지 않는다
+                if emit_worker is None:
+                    return
+
+                # 상태 표시가 꺼져 있으면 상태 이벤트는 클라이언트에 보내지 않는다
+                if not status_enabled and event["type"] == "status":
+                    return
+
+                # 클라이언트가 밀려 있으면 진행 상태는 다음 상태가 대신하므로 버린다
+                # 본문과 완료 이벤트는 버리지 않고 자리가 날 때까지 기다린다
+                if (
+                    event["type"] == "status"
+                    and not event["data"].get("done")
+                    and emit_queue.qsize() >= _STATUS_DROP_BACKLOG
+                ):
+                    # 줄이 연달아 들어오는 동안에는 전달 작업이 실행될 틈이 없어 큐가 쌓일 뿐이므로,
+                    # 한 번 양보해 비울 기회를 준 뒤에도 밀려 있을 때만 (= 클라이언트가 느릴 때만) 버린다
+                    await asyncio.sleep(0)
+                    if emit_queue.qsize() >= _STATUS_DROP_BACKLOG:
+                        return
+                await emit_queue.put(event)
+
+            try:
+                async with client.stream(
+                    "POST", "/search/stream", json={"prompt": prompt}
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        error_text = response.text
+                        logger.error(
+                            "API error: %s - %s", response.status_code, error_text
                         )
                         return {
                             "error": f"API returned status code {response.status_code}",
-                            "details": response.text,
+                            "details": error_text,
                         }
-            # If an event emitter is provided, use the streaming endpoint
-            else:
-                # Final results to return
-                final_results = {
-                    "original_prompt": prompt,
-                    "search_steps": [],
-                    "sources": [],
-                    "final_report": "",  # Store the final report here
-                }
-
-                async with httpx.AsyncClient(timeout=None) as client:
-                    headers = {
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {api_key}",
-                    }
-
-                    # Call the streaming endpoint (with search results and final report)
-                    async with client.stream(
-                        "POST",
-                        f"{self.valves.api_url}/search/stream",
-                        headers=headers,
-                        json={"prompt": prompt},
-                    ) as response:
-                        if response.status_code != 200:
-                            error_text = await response.text()
-                            print_log(
-                                "error",
-                                f"API error: {response.status_code} - {error_text}",
-                            )
-                            return {
-                                "error": f"API returned status code {response.status_code}",
-                                "details": error_text,
-                            }
-
-                        # Process the streaming response
-                        buffer = ""
-                        async for chunk in response.aiter_text():
-                            buffer += chunk
-
-                            # Process complete lines in the buffer
-                            while "\n" in buffer:
-                                line, buffer = buffer.split("\n", 1)
-                                if not line.strip():
-                                    continue
 
+                    # Process the streaming response
+                    loop = asyncio.get_running_loop()
+                    last_report_status = float("-inf")
+
+                    # 네트워크 읽기와 이벤트 처리를 분리해 느린 처리가 소켓 읽기를 막지 않게 한다
+                    line_queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+                    reader = asyncio.create_task(_read_lines(response, line_queue))
+
+                    # 이벤트마다 반복되는 속성 조회를 줄이기 위해 미리 지역 변수로 묶어 둔다
+                    loop_time = loop.time
+                    next_line = line_queue.get
+                    get_dispatch = _EVENT_DISPATCH.get
+                    json_loads = _json_loads
+
+                    # 스트림 하나가 쓸 수 있는 메모리 상한
+                    max_report_chars = self._v.max_report_chars
+                    max_search_steps = self._v.max_search_steps
+                    search_steps = final_results["search_steps"]
+                    report_total = 0
+
+                    # 보고서 청크는 일정 크기나 시간만큼 모아서 한 번에 전달한다
+                    pending_report: List[str] = []
+                    pending_size = 0
+                    last_flush = loop_time()
+
+                    async def flush_report():
+                        nonlocal pending_size, last_flush
+                        if pending_report:
+                            await emit(_message_delta("".join(pending_report)))
+                            pending_report.clear()
+                        pending_size = 0
+                        last_flush = loop_time()
+
+                    try:
+                        while True:
+                            if pending_report and line_queue.empty():
+                                # 다음 줄이 늦게 오면 전송 간격이 지났을 때 모아 둔 보고서를 먼저 보낸다
+                                remaining = _REPORT_FLUSH_INTERVAL - (
+                                    loop_time() - last_flush
+                                )
                                 try:
-                                    event_data = json.loads(line)
-                                    event_type = event_data.get("event")
-                                    data = event_data.get("data", {})
-
-                                    # Create a user-friendly message based on the event type
-                                    message = ""
-                                    if event_type == "search_start":
-                                        message = f"검색 시작: {data.get('prompt', '')[:50]}..."
-                                    elif event_type == "decomposed_queries":
-                                        queries = data.get("queries", [])
-                                        message = f"검색 쿼리 분해: {len(queries)}개의 쿼리로 분해됨"
-                                    elif event_type == "search_query":
-                                        message = f"검색 중: {data.get('query', '')}"
-                                    elif event_type == "search_results":
-                                        message = f"검색 결과: {data.get('query', '')}에 대해 {data.get('count', 0)}개 결과 발견"
-                                    elif event_type == "summarize_progress":
-                                        message = f"요약 중: {data.get('query', '')}의 결과 {data.get('current', 0)}/{data.get('total', 0)}"
-                                    elif event_type == "summarize_complete":
-                                        message = f"요약 완료: {data.get('query', '')}의 {data.get('count', 0)}개 결과"
-                                    elif event_type == "summarized_result":
-                                        message = f"요약 결과: {data.get('query', '')}의 {data.get('index', 0)}/{data.get('total', 0)} 번째 결과"
-
-                                        # Get the summarized result data
-                                        query = data.get("query", "")
-                                        original_result = data.get(
-                                            "original_result", {}
-                                        )
-                                        summarized_result = data.get(
-                                            "summarized_result", {}
-                                        )
-                                        index = data.get("index", 0)
-                                        total = data.get("total", 0)
-                                        is_additional = data.get("additional", False)
-
-                                        # Format the original result
-                                        title = original_result.get(
-                                            "title", "제목 없음"
-                                        )
-                                        link = original_result.get("link", "#")
-
-                                        # Format the summarized result for display
-                                        summary_message = (
-                                            f"### 검색 결과 요약 ({index}/{total})\n\n"
-                                        )
-                                        summary_message += (
-                                            f"**원본:** [{title}]({link})\n\n"
-                                        )
-                                        summary_message += f"**요약:**\n{summarized_result.get('content', '')}\n\n"
-                                        summary_message += f"**관련성:** {summarized_result.get('relevance', '알 수 없음')}\n\n"
-
-                                        # Stream the summarized result to the UI using chat:message:delta
-                                        await event_emitter(
-                                            {
-                                                "type": "chat:message:delta",
-                                                "data": {
-                                                    "content": summary_message + "\n\n"
-                                                },
-                                            }
-                                        )
-                                    elif event_type == "evaluation":
-                                        message = f"평가: {data.get('query', '')}는 {'충분함' if data.get('sufficient', False) else '불충분함'}"
-                                    elif (
-                                        event_type == "report_chunk"
-                                        or event_type == "report"
-                                    ):
-                                        message = (
-                                            "보고서 생성 중... (실시간으로 표시됩니다)"
-                                        )
-                                    elif event_type == "sources":
-                                        message = f"소스 정보: {len(data.get('sources', []))}개 소스 발견"
-                                    elif event_type == "search_complete":
-                                        message = "검색 및 보고서 생성 완료"
-                                    elif event_type == "error":
-                                        message = f"오류: {data.get('message', '')}"
-                                    else:
-                                        message = f"{event_type}: {json.dumps(data, ensure_ascii=False)[:50]}..."
-
-                                    # Forward the event to the client
-                                    await event_emitter(
-                                        {
-                                            "type": "status",
-                                            "data": {
-                                                "description": f"Open Search Agent: {message}",
-                                                "done": event_type == "search_complete",
-                                            },
-                                        }
+                                    line = await asyncio.wait_for(
+                                        next_line(), max(0.0, remaining)
                                     )
-
-                                    # Process different event types
-                                    if event_type == "search_start":
-                                        print_log(
-                                            "info",
-                                            f"Search started for: {data.get('prompt')}",
-                                        )
-
-                                    elif event_type == "decomposed_queries":
-                                        queries = data.get("queries", [])
-                                        print_log(
-                                            "info",
-                                            f"Decomposed into {len(queries)} queries",
-                                        )
-
-                                    elif event_type == "search_query":
-                                        query = data.get("query", "")
-                                        print_log("info", f"Searching for: {query}")
-
-                                    elif event_type == "search_results":
-                                        count = data.get("count", 0)
-                                        query = data.get("query", "")
-                                        results = data.get("results", [])
-                                        is_additional = data.get("additional", False)
-                                        print_log(
-                                            "info",
-                                            f"Found {count} results for: {query}",
-                                        )
-
-                                        # Format the search results for display
-                                        formatted_results = []
-                                        for i, result in enumerate(
-                                            results[:5]
-                                        ):  # Limit to first 5 results to avoid overwhelming the UI
-                                            title = result.get("title", "제목 없음")
-                                            link = result.get("link", "#")
-                                            snippet = result.get("snippet", "")
-
-                                            formatted_results.append(
-                                                f"**[{i+1}] {title}**\n링크: {link}\n{snippet}\n"
-                                            )
-
-                                        # Create a message to display the search results
-                                        search_results_message = (
-                                            f"### 검색 쿼리: {query}\n\n"
-                                            + "\n".join(formatted_results)
+                                except asyncio.TimeoutError:
+                                    await flush_report()
+                                    line = await next_line()
+                            else:
+                                line = await next_line()
+                            if line is None:
+                                break
+
+                            # 객체 모양이 아닌 줄은 디코드 예외를 만들지 않고 바로 건너뛴다
+                            if not (line.startswith(b"{") and line.endswith(b"}")):
+                                logger.error(
+                                    "Failed to parse event: %s",
+                                    line.decode("utf-8", "replace"),
+                                )
+                                continue
+
+                            try:
+                                event_data: StreamEvent = json_loads(line)
+                                event_get = event_data.get
+                                event_type = event_get("event")
+                                data = event_get("data") or {}
+                                formatter, handler = get_dispatch(
+                                    event_type, _NO_DISPATCH
+                                )
+
+                                if event_type in _REPORT_EVENTS:
+                                    content = data.get("content", "")
+                                    pending_report.append(content)
+                                    pending_size += len(content)
+                                    report_total += len(content)
+                                    if report_total > max_report_chars:
+                                        logger.error(
+                                            "Report exceeded %s characters, aborting",
+                                            max_report_chars,
                                         )
-                                        if len(results) > 5:
-                                            search_results_message += f"\n\n... 그 외 {len(results) - 5}개 결과"
-
-                                        # Stream the search results to the UI using chat:message:delta
-                                        await event_emitter(
-                                            {
-                                                "type": "status",
-                                                "data": {
-                                                    "action": "thinking",
-                                                    "description": "AI is thinking...",
-                                                    "done": False,
-                                                },
-                                            }
-                                        )
-                                    elif event_type == "evaluation":
-                                        query = data.get("query", "")
-                                        sufficient = data.get("sufficient", False)
-                                        reasoning = data.get("reasoning", "")
-                                        is_additional = data.get("additional", False)
-                                        print_log(
-                                            "info",
-                                            f"Evaluation for {query}: {'Sufficient' if sufficient else 'Insufficient'}",
-                                        )
-
-                                        # Add to search steps
-                                        final_results["search_steps"].append(
-                                            {
-                                                "query": query,
-                                                "results": data.get("results", []),
-                                                "sufficient": sufficient,
-                                                "reasoning": reasoning,
-                                            }
-                                        )
-
-                                        # Format the evaluation result for display
-                                        eval_message = (
-                                            f"### 검색 결과 평가: {query}\n\n"
-                                        )
-                                        eval_message += f"**결과:** {'충분함 ✅' if sufficient else '불충분함 ❌'}\n\n"
-                                        eval_message += f"**이유:**\n{reasoning}\n\n"
-
-                                        # Stream the evaluation result to the UI using chat:message:delta
-                                        await event_emitter(
-                                            {
-                                                "type": "chat:message:delta",
-                                                "data": {
-                                                    "content": eval_message + "\n\n"
-                                                },
-                                            }
-                                        )
-
-                                    elif (
-                                        event_type == "report_chunk"
-                                        or event_type == "report"
+                                        return {
+                                            "error": f"보고서가 최대 크기({max_report_chars}자)를 초과했습니다"
+                                        }
+                                    if (
+                                        pending_size >= _REPORT_FLUSH_SIZE
+                                        or loop_time() - last_flush
+                                        >= _REPORT_FLUSH_INTERVAL
                                     ):
-                                        # Process report chunks and display them in real-time
-                                        content = data.get("content", "")
-                                        print_log(
-                                            "info",
-                                            f"Received report chunk: {len(content)} characters",
-                                        )
-
-                                        # Append to the final report
-                                        final_results["final_report"] += content
-
-                                        # Stream the report chunk to the UI using chat:message:delta
-                                        await event_emitter(
-                                            {
-                                                "type": "chat:message:delta",
-                                                "data": {"content": content},
-                                            }
-                                        )
-
-                                    elif event_type == "sources":
-                                        final_results["sources"] = data.get(
-                                            "sources", []
-                                        )
-                                        print_log(
-                                            "info",
-                                            f"Received {len(final_results['sources'])} sources",
-                                        )
+                                        await flush_report()
+                                elif pending_report:
+                                    # 다른 이벤트 앞에 쌓인 보고서를 먼저 보내 순서를 유지한다
+                                    await flush_report()
+
+                                # 상태 메시지는 캐시 재생을 위해 항상 만들어 기록한다 (전달 여부는 emit에서 결정)
+                                send_status = True
+
+                                # 보고서 청크의 상태 메시지는 고정 문구이므로 일정 간격으로만 보낸다
+                                if event_type in _REPORT_EVENTS:
+                                    now = loop_time()
+                                    send_status = (
+                                        now - last_report_status
+                                        >= _REPORT_STATUS_INTERVAL
+                                    )
+                                    if send_status:
+                                        last_report_status = now
 
-                                    elif event_type == "search_complete":
-                                        print_log(
-                                            "info",
-                                            "Search and report generation completed",
-                                        )
+                                if send_status:
+                                    # Create a user-friendly message based on the event type
+                                    if formatter is not None:
+                                        message = formatter(data)
+                                    else:
+                                        message = f"{event_type}: {_truncated_repr(data, 50)}..."
 
-                                        # Send a completion message
-                                        await event_emitter(
-                                            {
-                                                "type": "chat:message:delta",
-                                                "data": {
-                                                    "content": "\n\n---\n\n**검색 및 보고서 생성이 완료되었습니다.**"
-                                                },
-                                            }
+                                    # Forward the event to the client
+                                    await emit(
+                                        _status_event(
+                                            f"Open Search Agent: {message}",
+                                            event_type == "search_complete",
                                         )
+                                    )
 
-                                        # Mark the assistant message as complete
-                                        await event_emitter(
-                                            {
-                                                "type": "assistant",
-                                                "data": {
-                                                    "content": "",  # Empty content as we've already streamed the report
-                                                    "done": True,
-                                                },
-                                            }
-                                        )
+                                # Process different event types
+                                if event_type == "error":
+                                    logger.error(
+                                        "Error from Open Search Agent: %s",
+                                        data.get("message"),
+                                    )
+                                    return {"error": data.get("message")}
 
-                                    elif event_type == "error":
-                                        print_log(
-                                            "error",
-                                            f"Error from Open Search Agent: {data.get('message')}",
-                                        )
-                                        return {"error": data.get("message")}
+                                if handler is not None:
+                                    await handler(final_results, data, emit)
 
-                                except json.JSONDecodeError:
-                                    print_log("error", f"Failed to parse event: {line}")
-                                except Exception as e:
-                                    print_log(
-                                        "error", f"Error processing event: {str(e)}"
+                                if len(search_steps) > max_search_steps:
+                                    logger.error(
+                                        "Search steps exceeded %s, aborting",
+                                        max_search_steps,
                                     )
-
-                return final_results
+                                    return {
+                                        "error": f"검색 단계가 최대 개수({max_search_steps}개)를 초과했습니다"
+                                    }
+
+                            except ValueError:  # json/orjson 디코드 오류 모두 ValueError 하위 클래스
+                                logger.error(
+                                    "Failed to parse event: %s",
+                                    line.decode("utf-8", "replace"),
+                                )
+                            except Exception as e:
+                                logger.error("Error processing event: %s", str(e))
+
+                        await flush_report()
+
+                        # 읽기 작업에서 발생한 네트워크 오류를 그대로 전달한다
+                        await reader
+                    finally:
+                        if not reader.done():
+                            reader.cancel()
+                            with suppress(asyncio.CancelledError):
+                                await reader
+            finally:
+                if emit_worker is not None:
+                    await emit_queue.put(None)
+                    await emit_worker
+
+            final_results["final_report"] = "".join(report_parts)
+            return final_results
 
         except Exception as e:
-            print_log("error", f"Error calling API: {str(e)}")
+            logger.error("Error calling API: %s", str(e))
             return {"error": str(e)}
 
     async def inlet(
@@ -456,7 +1139,7 @@ class Filter:
         """
         try:
             # Skip if filter is disabled
-            if not self.valves.status:
+            if not self._v.status:
                 return body
 
             # Skip if this is a title generation request
@@ -469,26 +1152,50 @@ class Filter:
                 return body
 
             # Get the last user message
-            user_message = get_last_user_message(messages)
+            user_message = _last_user_message(messages)
             if not user_message:
                 return body
 
-            # Emit status to client
-            await self.emit_status(
-                __event_emitter__,
-                level="status",
-                message="Open Search Agent에 검색 요청 중...",
-                done=False,
-            )
+            # 검색할 내용이 없는 짧은 메시지는 업스트림을 호출하지 않고 그대로 통과시킨다
+            if self._v.skip_trivial_messages and (
+                len(user_message.strip()) < self._v.min_prompt_chars
+                or _TRIVIAL_MESSAGE_PATTERN.match(user_message)
+            ):
+                logger.info("Skipping search for trivial message: %s", user_message)
+                await self.emit_status(
+                    __event_emitter__,
+                    level="status",
+                    message="Open Search Agent: 검색이 필요 없는 메시지라 검색을 건너뜀",
+                    done=True,
+                )
+                return body
 
             # Call the Open-Search-Agent API with streaming
             try:
-                # Call the API with the event emitter to get streaming updates
-                search_response = await self.call_open_search_agent(
-                    prompt=user_message,
-                    api_key=self.valves.api_key,
-                    event_emitter=__event_emitter__,
+                # 시작 상태 전송을 기다리지 않고 API 호출과 동시에 진행한다
+                # (상태 전송이 실패해도 검색은 취소되지 않는다)
+                status_result, search_response = await asyncio.gather(
+                    # Emit status to client
+                    self.emit_status(
+                        __event_emitter__,
+                        level="status",
+                        message="Open Search Agent에 검색 요청 중...",
+                        done=False,
+                    ),
+                    # Call the API with the event emitter to get streaming updates
+                    self.call_open_search_agent(
+                        prompt=user_message,
+                        api_key=self._v.api_key,
+                        event_emitter=__event_emitter__,
+                        # 요청 본문에 no_cache가 있으면 캐시를 건너뛰고 새로 검색한다
+                        use_cache=not body.get("no_cache", False),
+                    ),
+                    return_exceptions=True,
                 )
+                if isinstance(status_result, Exception):
+                    logger.warning("Failed to emit start status: %s", status_result)
+                if isinstance(search_response, BaseException):
+                    raise search_response
 
                 # Check if there was an error
                 if "error" in search_response:
@@ -509,9 +1216,11 @@ class Filter:
                 final_report = search_response.get("final_report", "")
 
                 # Log the search results
-                print_log(
-                    "info",
-                    f"검색 완료: {len(search_steps)} 단계, {len(sources)} 소스, 보고서 길이: {len(final_report)} 자",
+                logger.info(
+                    "검색 완료: %s 단계, %s 소스, 보고서 길이: %s 자",
+                    len(search_steps),
+                    len(sources),
+                    len(final_report),
                 )
 
                 # If we have a final report from the non-streaming API, use it directly
@@ -519,67 +1228,39 @@ class Filter:
                     # Create an assistant message with the final report
                     assistant_message = {"role": "assistant", "content": final_report}
 
-                    # Create a new message array with the original messages and the assistant message
-                    new_messages = []
-
-                    # Add the original messages
-                    for msg in messages:
-                        new_messages.append(msg)
-
-                    # Add the assistant message
-                    new_messages.append(assistant_message)
-
-                    # Update the body with the new messages
-                    body["messages"] = new_messages
+                    # Update the body with the original messages and the assistant message
+                    body["messages"] = [*messages, assistant_message]
                 else:
                     # Fallback to the old method if no final report is available
-                    # Format sources in a more readable way
-                    formatted_sources = []
-                    for i, source in enumerate(sources):
-                        title = source.get("title", "제목 없음")
-                        link = source.get("link", "#")
-                        content = source.get("content", "내용 없음")
-
-                        # Truncate content if too long
-                        if len(content) > 500:
-                            content = content[:500] + "..."
-
-                        formatted_sources.append(
-                            f"[{i+1}] {title}\n링크: {link}\n내용: {content}\n"
+                    parts = [
+                        _SYS_PREFIX,
+                        user_message,
+                        _SYS_QUERIES,
+                        ", ".join(step.get("query", "") for step in search_steps),
+                    ]
+
+                    # 소스가 없으면 소스 섹션을 통째로 생략하고, 많으면 앞쪽 일부만 넣는다
+                    if sources:
+                        parts.append(_SYS_SOURCES)
+                        parts.append(
+                            _format_sources(
+                                sources[: self._v.max_sources_in_prompt],
+                                self._v.sources_format,
+                            )
                         )
-
-                    formatted_sources_text = "\n".join(formatted_sources)
+                    parts.append(_SYS_SUFFIX)
 
                     # Create a system message with search results
-                    system_message = {
-                        "role": "system",
-                        "content": f"""
-다음은 Open Search Agent를 통해 검색한 결과입니다. 이 정보를 바탕으로 사용자의 질문에 답변해주세요.
-
-# 사용자 질문
-{user_message}
-
-# 검색 쿼리 및 결과
-{', '.join([step.get('query', '') for step in search_steps])}
-
-# 검색 소스
-{formatted_sources_text}
-
-위 정보를 바탕으로 사용자의 질문에 상세하게 답변해주세요. 소스 정보를 인용하고 출처를 명시해주세요.
-답변은 사용자가 이해하기 쉽게 구조화하고, 필요한 경우 마크다운 형식을 사용하여 가독성을 높여주세요.
-""",
-                    }
-
-                    # Create a new message array with the system message and the original user message
-                    new_messages = [system_message]
-
-                    # Add the original messages (except system messages)
-                    for msg in messages:
-                        if msg.get("role") != "system":
-                            new_messages.append(msg)
-
-                    # Update the body with the new messages
-                    body["messages"] = new_messages
+                    system_message = {"role": "system", "content": "".join(parts)}
+
+                    # Replace existing system messages with the search results message
+                    # 기존 시스템 메시지가 없는 흔한 경우에는 필터링 없이 앞에 붙이기만 한다
+                    if any(m.get("role") == "system" for m in messages):
+                        body["messages"] = [system_message] + [
+                            m for m in messages if m.get("role") != "system"
+                        ]
+                    else:
+                        body["messages"] = [system_message, *messages]
 
                 # Emit completion status
                 # For streaming mode, we've already sent the done=True event in the search_complete handler
@@ -591,7 +1272,7 @@ class Filter:
                 )
 
             except Exception as e:
-                print_log("error", f"API 호출 중 오류 발생: {str(e)}")
+                logger.error("API 호출 중 오류 발생: %s", str(e))
                 await self.emit_status(
                     __event_emitter__,
                     level="error",
@@ -602,14 +1283,8 @@ class Filter:
                 return body
 
         except Exception as e:
-            print_log("error", f"필터 처리 중 오류 발생: {str(e)}")
-            print_log("error", f"오류 유형: {type(e).__name__}")
-
-            # 스택 트레이스 출력
-            print_log(
-                "error",
-                f"스택 트레이스: {''.join(traceback.format_tb(e.__traceback__))}",
-            )
+            # 오류 유형과 스택 트레이스는 로깅 핸들러가 출력할 때만 포맷팅된다
+            logger.exception("필터 처리 중 오류 발생: %s", e)
 
             # 오류 상태 전송
             await self.emit_status(
@@ -1,8 +1,8 @@
 #기업 분석 보고서
 from pydantic import BaseModel, Field
 from typing import Callable, Awaitable, Any, Optional, TypedDict, List, Dict, Union
+import asyncio
 import json
-import re
 
 from open_webui.routers.retrieval import process_web_search, SearchForm
 from open_webui.utils.middleware import chat_web_search_handler
@@ -10,6 +10,143 @@ from open_webui.utils.chat import generate_chat_completion
 from open_webui.utils.misc import get_last_user_message
 from open_webui.models.users import Users, UserModel
 
+# 상태 이벤트 사이의 최소 전송 간격 (초)
+_EMIT_MIN_INTERVAL = 0.1
+
+
+async def _emit_worker(event_emitter, queue: asyncio.Queue):
+    """
+    큐에 쌓인 상태 이벤트를 순서대로 전달하는 백그라운드 작업 (None을 받으면 종료)
+    
+    직전과 같은 이벤트는 다시 보내지 않습니다. 진행 중(done=False) 상태는 직전 전송 후
+    _EMIT_MIN_INTERVAL이 지나야 보내며, 그 사이 다음 이벤트가 들어오면 다음 상태가 대신하므로 건너뜁니다.
+    완료(done=True) 상태는 기다리지 않고 바로 보냅니다.
+    """
+    loop = asyncio.get_running_loop()
+    last_event = None
+    last_sent = 0.0
+    while True:
+        event = await queue.get()
+        if event is None:
+            return
+        if event == last_event:
+            continue
+        if not event["data"].get("done"):
+            wait = last_sent + _EMIT_MIN_INTERVAL - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not queue.empty():
+                continue
+        try:
+            await event_emitter(event)
+        except Exception as e:
+            print(f"상태 이벤트 전송 중 오류 발생: {str(e)}")
+        last_event = event
+        last_sent = loop.time()
+
+
+# 단계별 LLM 호출의 system 프롬프트 (요청과 무관하게 항상 같음)
+_ANALYSIS_SYSTEM_PROMPT = """
+Analyze the user's corporate analysis request and return the following information in JSON format:
+{
+    "company_name": "분석 대상 기업명",
+    "industry": "기업이 속한 산업 분야",
+    "analysis_focus": "재무분석, 경쟁력 분석, 시장 점유율, 성장성, 투자 가치 등 분석 초점",
+    "keywords": ["핵심", "키워드", "목록"],
+    "preferred_format": "보고서, 요약, 목록, 단계별 설명 등",
+    "complexity": "간단/중간/복잡 - 질문의 복잡성 수준",
+    "needs_search": true/false - 웹 검색이 필요한지 여부,
+    "needs_financial_data": true/false - 재무 데이터가 필요한지 여부,
+    "preliminary_search_keywords": ["키워드1", "키워드2", "..."] // 사전 웹 검색을 위한 키워드
+}
+
+Return an empty object ({}) in the following cases:
+1. If a specific company name cannot be identified in the user's question
+2. If the question is not related to corporate analysis or corporate reporting
+3. If it's a general conversation or greeting
+4. If insufficient information is provided for corporate analysis
+5. If the question is about a topic other than corporate analysis
+"""
+
+_VALIDATION_SYSTEM_PROMPT = """
+You are an expert in validating and summarizing search results for corporate analysis reports.
+Analyze the user's corporate analysis request and web search results to return the following in JSON format:
+
+{
+    "content": "Organized text that can be used for corporate analysis reports, excluding unnecessary text from search results. Please exclude advertisements, duplicate content, irrelevant content, and include only useful information such as company information, financial data, market information, competitor information, etc.",
+}
+
+Return an empty object ({}) in the following cases:
+1. If a specific company cannot be identified from the search results
+2. If the search results are not related to corporate analysis
+3. If the search results are too general or insufficient to write a corporate report
+4. If the search results are about topics other than companies (e.g., general products, services, individuals, etc.)
+5. If it's not an existing company
+6. If there are typos in the company name
+"""
+
+_PLAN_SYSTEM_PROMPT = """
+You are an expert in developing corporate analysis plans. Based on the user's corporate analysis request and initial web search results,
+please create a detailed corporate analysis plan in JSON format:
+
+{
+    "analysis_plan": {
+        "company_name": "분석 대상 기업명",
+        "industry": "기업이 속한 산업 분야",
+        "main_question": "사용자의 주요 질문",
+        "analysis_sections": ["기업 개요", "산업 분석", "재무 분석", "경쟁사 분석", "SWOT 분석", "미래 전망", "투자 의견"],
+        "research_steps": [
+            {
+                "step": 1,
+                "description": "단계 설명 (예: 기업 기본 정보 수집)",
+                "search_queries": ["검색어 1", "검색어 2", ...],
+                "expected_outcomes": "이 단계에서 기대되는 결과"
+            },
+            ...
+        ],
+        "required_financial_data": ["Revenue", "Operating Profit", "Net Profit", "Debt Ratio", "ROE", ...],
+        "required_market_data": ["Market Size", "Market Share", "Competitor Status", ...],
+        "information_gaps": ["Currently missing information 1", "Currently missing information 2", ...],
+        "estimated_completion_steps": 5
+    }
+}
+"""
+
+_STEP_SYSTEM_PROMPT = (
+    "You are an expert in writing corporate analysis reports. Based on the information below, please write a detailed "
+    "report for this analysis step. The report should be objective and detailed, based on facts, "
+    "and up to 3000 words if necessary. Financial data, market data, competitor information, etc. should include "
+    "accurate figures and sources as much as possible."
+)
+
+_FINAL_SYSTEM_PROMPT = (
+    "You are an expert in writing comprehensive corporate analysis reports. Below are reports for each analysis step. "
+    "Based on these, please write a final comprehensive corporate analysis report. The report should follow this structure:\n\n"
+    "1. Executive Summary: Briefly summarize key analysis results and investment opinions\n"
+    "2. Company Overview: Company history, business areas, main products/services, management, etc.\n"
+    "3. Industry Analysis: Current status, trends, growth potential, regulatory environment, etc. of the industry\n"
+    "4. Financial Analysis: Analysis of key financial indicators such as sales, profits, growth rate, profitability, debt ratio, etc.\n"
+    "5. Competitor Analysis: Comparison with major competitors, market share, competitive advantages, etc.\n"
+    "6. SWOT Analysis: Analysis of strengths, weaknesses, opportunities, and threats\n"
+    "7. Future Outlook: Company growth strategy, new businesses, risk factors, etc.\n"
+    "8. Investment Opinion: Investment recommendation, target price, investment risks, etc.\n\n"
+    "The report should be objective and detailed, based on facts, and all figures and claims should include sources when possible. "
+    "Up to 4000 words are allowed if necessary.\n\n"
+    "**IMPORTANT**: You MUST write the final report in the SAME LANGUAGE as the user's original request. "
+    "If the user's request is in Korean, write the entire report in Korean. "
+    "If the user's request is in English, write the entire report in English. "
+    "Match the language of the user's original input exactly."
+)
+
+
+# 문자열의 지정한 위치부터 JSON 값 하나를 디코딩하고 (값, 끝 위치)를 반환 (C 구현 스캐너 사용)
+_raw_decode_json = json.JSONDecoder().raw_decode
+
+def dumps_compact(obj: Any) -> str:
+    """프롬프트에 넣을 JSON 문자열 (LLM에는 들여쓰기가 필요 없으므로 공백 없이 직렬화)"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
 # JSON 추출 공통 함수
 def extract_json_from_markdown(content: str) -> dict:
     """
@@ -22,24 +159,41 @@ def extract_json_from_markdown(content: str) -> dict:
         dict: 추출된 JSON 객체, 추출 실패 시 빈 딕셔너리 반환
     """
     try:
-        # ```json과 ``` 사이의 내용 추출
-        json_match = re.search(r'```(?:json)?\n(.*?)\n```', content, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-            # JSON 문자열을 객체로 변환
-            return json.loads(json_str)
-        else:
-            # 일반 텍스트에서 JSON 형식 찾기 시도
+        # 첫 '{' 위치와 첫 코드 펜스 안의 첫 '{' 위치에서만 JSON 객체 하나를 디코딩해 본다
+        # (정규식과 달리 JSON 문자열 값 안에 있는 ``` 에도 잘리지 않는다)
+        # 바깥 객체가 깨졌을 때 안쪽 '{'로 넘어가면 중첩된 조각이 결과로 나오므로 다른 위치는 시도하지 않는다
+        candidates = [content.find("{")]
+        fence = content.find("```")
+        if fence != -1:
+            candidates.append(content.find("{", fence + 3))
+        for start in dict.fromkeys(candidates):
+            if start == -1:
+                continue
             try:
-                return json.loads(content)
-            except:
-                print("JSON 형식을 찾을 수 없습니다.")
-                return {}
+                return _raw_decode_json(content, start)[0]
+            except ValueError:
+                pass
+
+        # 일반 텍스트에서 JSON 형식 찾기 시도
+        try:
+            return json.loads(content)
+        except:
+            print("JSON 형식을 찾을 수 없습니다.")
+            return {}
     except Exception as e:
         print(f"JSON 추출 중 오류 발생: {str(e)}")
         return {}
 
 
+def _fast_parse_json(content: str) -> dict:
+    """JSON 모드 응답은 그대로 파싱하고, 실패하면 마크다운에서 추출하는 경로로 넘어갑니다."""
+    try:
+        obj = json.loads(content)
+    except ValueError:
+        return extract_json_from_markdown(content)
+    return obj if isinstance(obj, dict) else extract_json_from_markdown(content)
+
+
 class Doc(TypedDict):
     # 문서의 실제 내용
     content: str
@@ -87,9 +241,85 @@ async def web_search(request: any, query: str) -> SearchResult:
         }
 
 
+async def gather_or_cancel(*aws) -> list:
+    """
+    작업을 모두 동시에 실행하고 결과를 순서대로 반환합니다.
+    
+    asyncio.gather는 하나가 실패해도 나머지 작업을 그대로 두므로, 실패하면 남은 작업을 취소하고
+    취소가 끝날 때까지 기다린 뒤 예외를 전달합니다 (남은 작업이 LLM 호출이나 검색을 계속하지 않도록).
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def dedupe_docs(results: List[dict]) -> List[Doc]:
+    """
+    여러 검색 결과의 문서를 모으면서 같은 문서는 한 번만 남깁니다 (처음 나온 순서 유지).
+    
+    겹치는 키워드로 검색하면 같은 페이지가 여러 번 돌아오므로, 출처 URL(없으면 content 앞부분)을
+    키로 중복을 제거해 LLM에 보내는 토큰을 줄이고 더 다양한 문서가 들어가게 합니다.
+    
+    Args:
+        results (List[dict]): web_search 결과 목록
+        
+    Returns:
+        List[Doc]: 중복이 제거된 문서 목록
+    """
+    unique = {}
+    for result in results:
+        for doc in result.get("docs", []):
+            key = (doc.get("metadata") or {}).get("source") or doc.get("content", "")[:256]
+            unique.setdefault(key, doc)
+    return list(unique.values())
+
+
+def join_doc_contents(docs: List[Doc], sep: str, limit: int = 0) -> str:
+    """
+    문서 content를 sep으로 이어 붙이되, limit 글자에 도달하면 나머지 문서는 읽지 않고 멈춥니다.
+    
+    Args:
+        docs (List[Doc]): 검색 결과 문서 목록
+        sep (str): 문서 사이 구분자
+        limit (int): 최대 글자 수 (0 이하이면 제한 없음)
+        
+    Returns:
+        str: 이어 붙인 텍스트
+    """
+    if limit <= 0:
+        return sep.join(doc.get("content", "") for doc in docs)
+    
+    parts = []
+    remaining = limit
+    for doc in docs:
+        content = doc.get("content", "")
+        if parts:
+            remaining -= len(sep)
+        if remaining <= 0:
+            break
+        if len(content) >= remaining:
+            parts.append(content[:remaining])
+            break
+        parts.append(content)
+        remaining -= len(content)
+    return sep.join(parts)
+
+
 class Filter:
     class Valves(BaseModel):
         status: bool = Field(default=True)
+        # 검증 LLM 호출과 계획 생성 LLM 호출을 동시에 진행 (계획에는 검증 요약 대신 원본 검색 내용이 들어감)
+        speculative_plan: bool = Field(default=False)
+        # 스탭별 보고서 프롬프트에 넣는 검색 결과 텍스트의 최대 글자 수 (0이면 제한 없음)
+        max_step_search_chars: int = Field(default=50000)
+        # 모든 요청을 통틀어 동시에 진행할 LLM 호출 / 웹 검색 수 (제공자 rate limit에 맞게 조정)
+        llm_concurrency: int = Field(default=8)
+        search_concurrency: int = Field(default=6)
 
 
     async def emit_status(
@@ -113,6 +343,31 @@ class Filter:
         
     def __init__(self):
         self.valves = self.Valves()
+        # 동시 실행 제한용 세마포어: {이름: (제한 수, 세마포어)}
+        self._semaphores = {}
+
+    def _get_semaphore(self, name: str, limit: int) -> asyncio.Semaphore:
+        """이름별로 공유하는 세마포어를 반환 (밸브 값이 바뀌면 새로 만듦)"""
+        limit = max(1, limit)
+        cached = self._semaphores.get(name)
+        if cached is None or cached[0] != limit:
+            cached = (limit, asyncio.Semaphore(limit))
+            self._semaphores[name] = cached
+        return cached[1]
+
+    async def _web_search(self, request: Any, query: str) -> SearchResult:
+        """동시 검색 수 제한 안에서 웹 검색"""
+        async with self._get_semaphore("search", self.valves.search_concurrency):
+            return await web_search(request, query)
+
+    async def _chat_completion(self, request: Any, form_data: dict, user: Any) -> dict:
+        """동시 LLM 호출 수 제한 안에서 chat completion 요청"""
+        async with self._get_semaphore("llm", self.valves.llm_concurrency):
+            return await generate_chat_completion(
+                request=request,
+                form_data=form_data,
+                user=user,
+            )
 
     async def inlet(
         self,
@@ -122,6 +377,14 @@ class Filter:
         __user__: Optional[dict] = None,
         __model__: Optional[dict] = None,
     ) -> dict:
+        # 상태 이벤트는 큐에 넣기만 하고 전달은 백그라운드 작업이 맡는다
+        # (동시에 진행되는 검색/스탭이 이벤트 전달을 기다리며 멈추지 않게 함)
+        emit_queue = asyncio.Queue()
+        emit_worker = asyncio.create_task(_emit_worker(__event_emitter__, emit_queue))
+
+        async def emit(event: dict):
+            emit_queue.put_nowait(event)
+
         try:
 
             
@@ -133,28 +396,7 @@ class Filter:
             # 사용자 질문 분석 →
 
             analysis_prompt = [
-                {"role": "system", "content": """
-                Analyze the user's corporate analysis request and return the following information in JSON format:
-                {
-                    "company_name": "분석 대상 기업명",
-                    "industry": "기업이 속한 산업 분야",
-                    "analysis_focus": "재무분석, 경쟁력 분석, 시장 점유율, 성장성, 투자 가치 등 분석 초점",
-                    "keywords": ["핵심", "키워드", "목록"],
-                    "preferred_format": "보고서, 요약, 목록, 단계별 설명 등",
-                    "complexity": "간단/중간/복잡 - 질문의 복잡성 수준",
-                    "needs_search": true/false - 웹 검색이 필요한지 여부,
-                    "needs_financial_data": true/false - 재무 데이터가 필요한지 여부,
-                    "preliminary_search_keywords": ["키워드1", "키워드2", "..."] // 사전 웹 검색을 위한 키워드
-                }
-                
-                Return an empty object ({}) in the following cases:
-                1. If a specific company name cannot be identified in the user's question
-                2. If the question is not related to corporate analysis or corporate reporting
-                3. If it's a general conversation or greeting
-                4. If insufficient information is provided for corporate analysis
-                5. If the question is about a topic other than corporate analysis
-                """
-                },
+                {"role": "system", "content": _ANALYSIS_SYSTEM_PROMPT},
                 {"role": "user", "content": f"Please analyze the following corporate analysis request: {user_message}"}
             ]
 
@@ -162,9 +404,10 @@ class Filter:
                     "model": "o3-mini",
                     "messages": analysis_prompt,
                     "stream": False,
+                    "response_format": {"type": "json_object"},
                 }
 
-            analysis_response = await generate_chat_completion(
+            analysis_response = await self._chat_completion(
                 request=__request__,
                 form_data=analysis_payload,
                 user=user,
@@ -173,12 +416,12 @@ class Filter:
             content = analysis_response.get('choices', [{}])[0].get('message', {}).get('content', '')
             
             # 공통 함수를 사용하여 JSON 객체 추출
-            analysis_obj = extract_json_from_markdown(content)
+            analysis_obj = _fast_parse_json(content)
             
             # 빈 객체인 경우 함수 종료
-            if not analysis_obj or len(analysis_obj) == 0:
+            if not analysis_obj:
                 await self.emit_status(
-                    __event_emitter__,
+                    emit,
                     level="status",
                     message="기업 분석을 위한 충분한 정보가 없습니다. 일반 대화 모드로 전환합니다.",
                     done=True,
@@ -188,71 +431,54 @@ class Filter:
 
             websearch_keywords = analysis_obj.get("preliminary_search_keywords", [])
 
-            # 웹 검색 결과를 저장할 리스트
-            search_results = []
+            # 각 키워드에 대한 웹 검색을 동시에 수행 (전체 시간은 가장 느린 검색 하나 수준)
+            await self.emit_status(
+                emit,
+                level="status",
+                message=f"키워드 {len(websearch_keywords)}개에 대한 웹 검색 중...",
+                done=False,
+            )
+            search_results = await asyncio.gather(
+                *(self._web_search(__request__, keyword) for keyword in websearch_keywords),
+                return_exceptions=True,
+            )
+            # 실패한 검색은 제외
+            search_results = [r for r in search_results if isinstance(r, dict)]
+                
+            # 검색 결과 취합 (문서와 URL 모두 순서를 유지한 채 중복 제거)
+            combined_docs = dedupe_docs(search_results)
+            combined_urls = list(dict.fromkeys(url for result in search_results for url in result.get("urls", [])))
             
-            # 각 키워드에 대한 웹 검색 수행 및 결과 저장
-            for keyword in websearch_keywords:
+            # 검색 결과가 하나도 없으면 검증할 내용이 없으므로 LLM 호출 없이 종료
+            if not combined_docs:
                 await self.emit_status(
-                    __event_emitter__,
+                    emit,
                     level="status",
-                    message=f"키워드 '{keyword}'에 대한 웹 검색 중...",
-                    done=False,
+                    message="기업 분석을 위한 검색 결과가 없습니다. 일반 대화 모드로 전환합니다.",
+                    done=True,
                 )
-                web_search_result = await web_search(__request__, keyword)
-                search_results.append(web_search_result)
-                
-            # 검색 결과 취합
-            combined_docs = []
-            combined_urls = []
-            
-            for result in search_results:
-                if "docs" in result:
-                    combined_docs.extend(result.get("docs", []))
-                if "urls" in result:
-                    combined_urls.extend(result.get("urls", []))
-                    
-            # 중복 URL 제거
-            combined_urls = list(dict.fromkeys(combined_urls))
-            
+                return body
                    
             # 검색 결과 검증 및 요약 단계 추가
             await self.emit_status(
-                __event_emitter__,
+                emit,
                 level="status",
                 message="검색 결과 검증 및 요약 중...",
                 done=False,
             )
             
-            # 검색 결과 내용 추출
-            search_content = ""
-            for doc in combined_docs[:5]:  # 처음 5개 문서만 사용 (너무 길어지지 않도록)
-                search_content += doc.get("content", "") + "\n\n"
+            # 검색 결과 내용 추출 (처음 5개 문서만 사용 - 너무 길어지지 않도록)
+            # 프롬프트에는 5000자까지만 들어가므로 그 이상은 처음부터 이어 붙이지 않는다
+            search_content = join_doc_contents(combined_docs[:5], "\n\n", 5000)
             
             # 검색 결과 검증 및 요약 프롬프트
             validation_prompt = [
-                {"role": "system", "content": """
-                You are an expert in validating and summarizing search results for corporate analysis reports.
-                Analyze the user's corporate analysis request and web search results to return the following in JSON format:
-                
-                {
-                    "content": "Organized text that can be used for corporate analysis reports, excluding unnecessary text from search results. Please exclude advertisements, duplicate content, irrelevant content, and include only useful information such as company information, financial data, market information, competitor information, etc.",
-                }
-                
-                Return an empty object ({}) in the following cases:
-                1. If a specific company cannot be identified from the search results
-                2. If the search results are not related to corporate analysis
-                3. If the search results are too general or insufficient to write a corporate report
-                4. If the search results are about topics other than companies (e.g., general products, services, individuals, etc.)
-                5. If it's not an existing company
-                6. If there are typos in the company name
-                """
-                },
+                {"role": "system", "content": _VALIDATION_SYSTEM_PROMPT},
                 {"role": "user", "content": f"""
                 User's corporate analysis request: {user_message}
                                                                 
                 Sample search result content:
-                {search_content[:5000] if len(search_content) > 5000 else search_content}
+                {search_content}
                 
                 Based on the above information, please verify if the search results are suitable for writing a corporate analysis report and summarize the key content for use in the Plan.
                 """}
@@ -263,24 +489,71 @@ class Filter:
                 "model": "o3-mini",
                 "messages": validation_prompt,
                 "stream": False,
+                "response_format": {"type": "json_object"},
             }
             
-            validation_response = await generate_chat_completion(
-                request=__request__,
-                form_data=validation_payload,
-                user=user,
-            )
+            # 계획 생성을 위한 프롬프트 작성 (계획에 넣을 검색 요약을 받아 요청 payload를 만든다)
+            def build_plan_payload(search_summary: dict) -> dict:
+                plan_prompt = [
+                    {"role": "system", "content": _PLAN_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"""
+                    Corporate analysis request: {user_message}
+                
+                    Initial analysis results: {dumps_compact(analysis_obj)}
+                
+                    Initial web search keywords: {websearch_keywords}
+
+                    Initial web search summary: {dumps_compact(search_summary)}
+                
+                    Based on the above information, please create a detailed corporate analysis plan in JSON format.
+                    """}
+                ]
+            
+                # 계획 생성 요청
+                return {
+                    "model": "o3-mini",
+                    "messages": plan_prompt,
+                    "stream": False,
+                    "response_format": {"type": "json_object"},
+                }
+            
+            # speculative_plan이 켜져 있으면 검증을 기다리지 않고 원본 검색 내용으로 계획 생성을 동시에 시작한다
+            plan_task = None
+            if self.valves.speculative_plan:
+                plan_task = asyncio.create_task(
+                    self._chat_completion(
+                        request=__request__,
+                        form_data=build_plan_payload({"content": search_content}),
+                        user=user,
+                    )
+                )
+                # 결과를 쓰지 않고 버리는 경우에도 실패한 예외를 확인 처리해 "never retrieved" 경고를 막는다
+                # (await하는 경우에는 예외가 그대로 전달된다)
+                plan_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            
+            try:
+                validation_response = await self._chat_completion(
+                    request=__request__,
+                    form_data=validation_payload,
+                    user=user,
+                )
+            except BaseException:
+                if plan_task is not None:
+                    plan_task.cancel()
+                raise
             
             # 검증 응답에서 content 추출
             validation_content = validation_response.get('choices', [{}])[0].get('message', {}).get('content', '')
             
             # JSON 객체 추출
-            validation_obj = extract_json_from_markdown(validation_content)
+            validation_obj = _fast_parse_json(validation_content)
             
             # 검증 결과가 유효하지 않은 경우 함수 종료
-            if not validation_obj or len(validation_obj) == 0:
+            if not validation_obj:
+                if plan_task is not None:
+                    plan_task.cancel()
                 await self.emit_status(
-                    __event_emitter__,
+                    emit,
                     level="status",
                     message="기업 분석을 위한 충분한 정보가 없습니다. 일반 대화 모드로 전환합니다.",
                     done=True,
@@ -288,82 +561,36 @@ class Filter:
                 return body
             
             await self.emit_status(
-                __event_emitter__,
+                emit,
                 level="status",
                 message="검색 결과 검증 및 요약 완료",
                 done=True,
             )
             
-            # 계획 생성을 위한 프롬프트 작성
-            plan_prompt = [
-                {"role": "system", "content": """
-                You are an expert in developing corporate analysis plans. Based on the user's corporate analysis request and initial web search results,
-                please create a detailed corporate analysis plan in JSON format:
-                
-                {
-                    "analysis_plan": {
-                        "company_name": "분석 대상 기업명",
-                        "industry": "기업이 속한 산업 분야",
-                        "main_question": "사용자의 주요 질문",
-                        "analysis_sections": ["기업 개요", "산업 분석", "재무 분석", "경쟁사 분석", "SWOT 분석", "미래 전망", "투자 의견"],
-                        "research_steps": [
-                            {
-                                "step": 1,
-                                "description": "단계 설명 (예: 기업 기본 정보 수집)",
-                                "search_queries": ["검색어 1", "검색어 2", ...],
-                                "expected_outcomes": "이 단계에서 기대되는 결과"
-                            },
-                            ...
-                        ],
-                        "required_financial_data": ["Revenue", "Operating Profit", "Net Profit", "Debt Ratio", "ROE", ...],
-                        "required_market_data": ["Market Size", "Market Share", "Competitor Status", ...],
-                        "information_gaps": ["Currently missing information 1", "Currently missing information 2", ...],
-                        "estimated_completion_steps": 5
-                    }
-                }
-                """
-                },
-                {"role": "user", "content": f"""
-                Corporate analysis request: {user_message}
-                
-                Initial analysis results: {json.dumps(analysis_obj, ensure_ascii=False)}
-                
-                Initial web search keywords: {websearch_keywords}
-
-                Initial web search summary: {json.dumps(validation_obj, ensure_ascii=False)}
-                
-                Based on the above information, please create a detailed corporate analysis plan in JSON format.
-                """}
-            ]
-            
-            # 계획 생성 요청
-            plan_payload = {
-                "model": "o3-mini",
-                "messages": plan_prompt,
-                "stream": False,
-            }
-            
             await self.emit_status(
-                __event_emitter__,
+                emit,
                 level="status",
                 message="연구 계획 생성 중...",
                 done=False,
             )
             
-            plan_response = await generate_chat_completion(
-                request=__request__,
-                form_data=plan_payload,
-                user=user,
-            )
+            if plan_task is not None:
+                plan_response = await plan_task
+            else:
+                plan_response = await self._chat_completion(
+                    request=__request__,
+                    form_data=build_plan_payload(validation_obj),
+                    user=user,
+                )
             
             # 계획 응답에서 content 추출
             plan_content = plan_response.get('choices', [{}])[0].get('message', {}).get('content', '')
             
             # JSON 객체 추출
-            research_plan = extract_json_from_markdown(plan_content)
+            research_plan = _fast_parse_json(plan_content)
             
             await self.emit_status(
-                __event_emitter__,
+                emit,
                 level="status",
                 message="기업 분석 계획 생성 완료",
                 done=True,
@@ -373,65 +600,58 @@ class Filter:
             print(research_plan)
             print("################################################ 기업 분석 계획 끝 #########################################")
 
-            # 분석 계획 스탭 별 상세 검색 및 개별 보고서 생성
-            step_reports = []  # 각 스탭별 보고서를 저장할 리스트
+            # 스탭마다 다시 조회하지 않도록 계획 공통 정보를 미리 꺼내 둔다
+            analysis_plan = research_plan.get("analysis_plan", {})
+            company_name = analysis_plan.get("company_name", "Not specified")
+            industry = analysis_plan.get("industry", "Not specified")
             
-            for step in research_plan.get("analysis_plan", {}).get("research_steps", []):
+            # 분석 계획 스탭 별 상세 검색 및 개별 보고서 생성
+            # 스탭끼리는 서로의 결과를 쓰지 않으므로 모든 스탭을 동시에 진행한다
+            async def process_step(step: dict) -> dict:
                 step_number = step.get("step", "N/A")
                 step_description = step.get("description", "")
                 step_search_queries = step.get("search_queries", [])
                 step_expected_outcomes = step.get("expected_outcomes", "")
                 
                 await self.emit_status(
-                    __event_emitter__,
+                    emit,
                     level="status",
                     message=f"기업 분석 계획 스탭 {step_number}에 대한 상세 검색 및 보고서 작성 시작...",
                     done=False,
                 )
                 
-                # 각 스탭의 검색 결과 취합
-                step_combined_docs = []
-                step_combined_urls = []
-                for query in step_search_queries:
-                    await self.emit_status(
-                        __event_emitter__,
-                        level="status",
-                        message=f"스탭 {step_number}: 키워드 '{query}' 웹 검색 중...",
-                        done=False,
-                    )
-                    search_result = await web_search(__request__, query)
-                    if search_result:
-                        if "docs" in search_result:
-                            step_combined_docs.extend(search_result.get("docs", []))
-                        if "urls" in search_result:
-                            step_combined_urls.extend(search_result.get("urls", []))
+                await self.emit_status(
+                    emit,
+                    level="status",
+                    message=f"스탭 {step_number}: 키워드 {len(step_search_queries)}개 웹 검색 중...",
+                    done=False,
+                )
+                step_search_results = await asyncio.gather(
+                    *(self._web_search(__request__, query) for query in step_search_queries),
+                    return_exceptions=True,
+                )
+                step_search_results = [r for r in step_search_results if isinstance(r, dict)]
                 
-                # 중복 URL 제거
-                step_combined_urls = list(dict.fromkeys(step_combined_urls))
+                # 각 스탭의 검색 결과 취합 (문서와 URL 모두 순서를 유지한 채 중복 제거)
+                step_combined_docs = dedupe_docs(step_search_results)
+                step_combined_urls = list(dict.fromkeys(url for result in step_search_results for url in result.get("urls", [])))
                 
                 # 검색 결과의 요약 텍스트 생성 (docs의 content를 간단히 결합)
-                combined_search_text = ""
-                for doc in step_combined_docs:
-                    combined_search_text += doc.get("content", "") + "\n"
+                combined_search_text = join_doc_contents(step_combined_docs, "\n", self.valves.max_step_search_chars)
                 if step_combined_urls:
-                    combined_search_text += "\n관련 URL: " + ", ".join(step_combined_urls)
+                    combined_search_text += "\n\n관련 URL: " + ", ".join(step_combined_urls)
                 
                 # 스탭별 보고서 생성을 위한 프롬프트 구성
                 step_prompt = [
                     {
                         "role": "system",
-                        "content": (
-                            "You are an expert in writing corporate analysis reports. Based on the information below, please write a detailed "
-                            "report for this analysis step. The report should be objective and detailed, based on facts, "
-                            "and up to 3000 words if necessary. Financial data, market data, competitor information, etc. should include "
-                            "accurate figures and sources as much as possible."
-                        )
+                        "content": _STEP_SYSTEM_PROMPT
                     },
                     {
                         "role": "user",
                         "content": f"""
-Company Name: {research_plan.get("analysis_plan", {}).get("company_name", "Not specified")}
-Industry: {research_plan.get("analysis_plan", {}).get("industry", "Not specified")}
+Company Name: {company_name}
+Industry: {industry}
 Analysis Step: {step_number}
 Step Description: {step_description}
 Search Keywords: {step_search_queries}
@@ -444,14 +664,14 @@ Expected Outcomes: {step_expected_outcomes}
                 ]
                 
                 await self.emit_status(
-                    __event_emitter__,
+                    emit,
                     level="status",
                     message=f"기업 분석 계획 스탭 {step_number}에 대한 보고서 작성 중...",
                     done=False,
                 )
                 
                 # LLM을 통해 스탭별 보고서 생성 요청
-                step_report_response = await generate_chat_completion(
+                step_report_response = await self._chat_completion(
                     request=__request__,
                     form_data={
                         "model": "o3-mini",
@@ -463,19 +683,24 @@ Expected Outcomes: {step_expected_outcomes}
                 
                 step_report_content = step_report_response.get("choices", [{}])[0].get("message", {}).get("content", "")
                 
-                # 개별 스탭 보고서 저장
-                step_reports.append({
-                    "step": step_number,
-                    "report": step_report_content,
-                })
-                
                 await self.emit_status(
-                    __event_emitter__,
+                    emit,
                     level="status",
                     message=f"기업 분석 계획 스탭 {step_number} 보고서 작성 완료",
                     done=True,
                 )
+                
+                # 개별 스탭 보고서 반환
+                return {
+                    "step": step_number,
+                    "report": step_report_content,
+                }
             
+            # 각 스탭별 보고서를 저장할 리스트 (gather는 계획의 스탭 순서를 유지한다)
+            # 한 스탭이 실패하면 나머지 스탭도 취소한다
+            step_reports = await gather_or_cancel(
+                *(process_step(step) for step in analysis_plan.get("research_steps", []))
+            )
             
             # 모든 스탭의 개별 보고서가 생성된 후 최종 종합 보고서 요청 프롬프트 생성
             combined_step_reports_text = ""
@@ -485,31 +710,14 @@ Expected Outcomes: {step_expected_outcomes}
             final_report_prompt = [
                 {
                     "role": "system",
-                    "content": (
-                        "You are an expert in writing comprehensive corporate analysis reports. Below are reports for each analysis step. "
-                        "Based on these, please write a final comprehensive corporate analysis report. The report should follow this structure:\n\n"
-                        "1. Executive Summary: Briefly summarize key analysis results and investment opinions\n"
-                        "2. Company Overview: Company history, business areas, main products/services, management, etc.\n"
-                        "3. Industry Analysis: Current status, trends, growth potential, regulatory environment, etc. of the industry\n"
-                        "4. Financial Analysis: Analysis of key financial indicators such as sales, profits, growth rate, profitability, debt ratio, etc.\n"
-                        "5. Competitor Analysis: Comparison with major competitors, market share, competitive advantages, etc.\n"
-                        "6. SWOT Analysis: Analysis of strengths, weaknesses, opportunities, and threats\n"
-                        "7. Future Outlook: Company growth strategy, new businesses, risk factors, etc.\n"
-                        "8. Investment Opinion: Investment recommendation, target price, investment risks, etc.\n\n"
-                        "The report should be objective and detailed, based on facts, and all figures and claims should include sources when possible. "
-                        "Up to 4000 words are allowed if necessary.\n\n"
-                        "**IMPORTANT**: You MUST write the final report in the SAME LANGUAGE as the user's original request. "
-                        "If the user's request is in Korean, write the entire report in Korean. "
-                        "If the user's request is in English, write the entire report in English. "
-                        "Match the language of the user's original input exactly."
-                    )
+                    "content": _FINAL_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": f"""
 User's corporate analysis request: {user_message}
 
-Corporate Analysis Plan Overview: {json.dumps(research_plan, ensure_ascii=False, indent=2)}
+Corporate Analysis Plan Overview: {dumps_compact(research_plan)}
 
 Reports for each analysis step:
 {combined_step_reports_text}
@@ -525,7 +733,7 @@ Based on the above information, please write a comprehensive and detailed final
             body["messages"] = final_report_prompt
             
             await self.emit_status(
-                __event_emitter__,
+                emit,
                 level="status",
                 message="최종 기업 분석 보고서 요청 프롬프트 생성 완료",
                 done=True,
@@ -545,5 +753,10 @@ Based on the above information, please write a comprehensive and detailed final
             print("스택 트레이스:")
             print(''.join(traceback.format_tb(e.__traceback__)))
             
+        finally:
+            # 남은 상태 이벤트를 모두 전달한 뒤 작업 종료
+            emit_queue.put_nowait(None)
+            await emit_worker
+            
         return body
 
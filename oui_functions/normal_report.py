@@ -1,8 +1,11 @@
 #범용 보고서
 from pydantic import BaseModel, Field
 from typing import Callable, Awaitable, Any, Optional, TypedDict, List, Dict, Union
+import asyncio
 import json
 import re
+import time
+import traceback
 
 from open_webui.routers.retrieval import process_web_search, SearchForm
 from open_webui.utils.middleware import chat_web_search_handler
@@ -10,6 +13,23 @@ from open_webui.utils.chat import generate_chat_completion
 from open_webui.utils.misc import get_last_user_message
 from open_webui.models.users import Users, UserModel
 
+try:
+    from orjson import OPT_INDENT_2, dumps as _orjson_dumps, loads as _json_loads
+
+    def _json_dumps(obj: Any, indent: bool = False) -> str:
+        """JSON 문자열로 직렬화 (orjson은 한글을 이스케이프하지 않고 UTF-8 그대로 출력)"""
+        return _orjson_dumps(obj, option=OPT_INDENT_2 if indent else None).decode()
+
+except ImportError:
+    from json import loads as _json_loads
+
+    def _json_dumps(obj: Any, indent: bool = False) -> str:
+        """JSON 문자열로 직렬화"""
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+# ```json 코드 펜스 안의 내용을 찾는 정규식 (호출마다 패턴을 다시 찾지 않도록 미리 컴파일)
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\n(.*?)\n```', re.DOTALL)
+
 # JSON 추출 공통 함수
 def extract_json_from_markdown(content: str) -> dict:
     """
@@ -22,24 +42,65 @@ def extract_json_from_markdown(content: str) -> dict:
         dict: 추출된 JSON 객체, 추출 실패 시 빈 딕셔너리 반환
     """
     try:
-        # ```json과 ``` 사이의 내용 추출
-        json_match = re.search(r'```(?:json)?\n(.*?)\n```', content, re.DOTALL)
+        # 첫 코드 펜스가 ``` 또는 ```json 이면 정규식 없이 문자열 탐색만으로 내용을 꺼낸다
+        start = content.find("```")
+        if start != -1:
+            newline = content.find("\n", start + 3)
+            if newline != -1 and content[start + 3:newline] in ("", "json"):
+                end = content.find("\n```", newline)
+                if end != -1:
+                    return _json_loads(content[newline + 1:end])
+
+        # ```json과 ``` 사이의 내용 추출 (첫 펜스가 다른 언어이거나 닫히지 않은 경우)
+        json_match = _JSON_FENCE_RE.search(content)
         if json_match:
             json_str = json_match.group(1)
             # JSON 문자열을 객체로 변환
-            return json.loads(json_str)
+            return _json_loads(json_str)
         else:
-            # 일반 텍스트에서 JSON 형식 찾기 시도
-            try:
-                return json.loads(content)
-            except:
-                print("JSON 형식을 찾을 수 없습니다.")
-                return {}
+            # 일반 텍스트에서 JSON 형식 찾기 시도 (JSON으로 시작하지 않는 글은 파싱해 보지 않는다)
+            stripped = content.lstrip()
+            if stripped.startswith(("{", "[")):
+                try:
+                    return _json_loads(stripped)
+                except ValueError:
+                    pass
+            print("JSON 형식을 찾을 수 없습니다.")
+            return {}
     except Exception as e:
         print(f"JSON 추출 중 오류 발생: {str(e)}")
         return {}
 
 
+# 사용자 조회 캐시: {user_id: (만료 시각, 사용자)}
+_USER_CACHE_MAXSIZE = 512
+_user_cache: dict = {}
+
+
+def get_user_cached(user_id: str, ttl: int):
+    """Users.get_user_by_id 결과를 TTL 동안 재사용 (대화마다 DB 조회를 반복하지 않도록)"""
+    if ttl <= 0:
+        return Users.get_user_by_id(user_id)
+
+    now = time.monotonic()
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        if cached[0] > now:
+            return cached[1]
+        # 만료된 항목은 발견 즉시 제거
+        del _user_cache[user_id]
+
+    user = Users.get_user_by_id(user_id)
+
+    if user is not None:
+        if len(_user_cache) >= _USER_CACHE_MAXSIZE:
+            # 가장 오래된 항목부터 제거
+            _user_cache.pop(next(iter(_user_cache)))
+        _user_cache[user_id] = (now + ttl, user)
+
+    return user
+
+
 class Doc(TypedDict):
     # 문서의 실제 내용
     content: str
@@ -72,7 +133,11 @@ async def web_search(request: any, query: str) -> SearchResult:
     try:
         result = await process_web_search(request, form_data)
         return {
-            "docs": result.get("docs", []),
+            # content가 문자열이 아닌 문서만 버리고 나머지 문서와 URL은 그대로 쓴다
+            "docs": [
+                doc for doc in result.get("docs", [])
+                if isinstance(doc, dict) and isinstance(doc.get("content"), str)
+            ],
             "name": query,
             "type": "web_search",
             "urls": result["filenames"],
@@ -87,9 +152,35 @@ async def web_search(request: any, query: str) -> SearchResult:
         }
 
 
+async def gather_or_cancel(*aws) -> list:
+    """
+    작업을 모두 동시에 실행하고 결과를 순서대로 반환합니다.
+    
+    asyncio.gather는 하나가 실패해도 나머지 작업을 그대로 두므로, 실패하면 남은 작업을 취소하고
+    취소가 끝날 때까지 기다린 뒤 예외를 전달합니다 (남은 작업이 LLM 호출이나 검색을 계속하지 않도록).
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
 class Filter:
     class Valves(BaseModel):
         status: bool = Field(default=True)
+        # 사용자 조회 결과 캐시 유지 시간(초), 0이면 매번 조회
+        user_cache_ttl: int = Field(default=60)
+        # 계획 프롬프트에 넣을 사전 검색 문서 수와 문서당 본문 길이 (문서 전체를 넣으면 입력 토큰이 크게 늘어남)
+        plan_max_docs: int = Field(default=20)
+        plan_doc_snippet_chars: int = Field(default=500)
+        # 스탭 보고서를 한 번의 LLM 요청으로 작성할지 여부 (스탭별 요청은 동시에 실행되므로 기본은 꺼 둠)
+        batch_steps: bool = Field(default=False)
+        # 모든 요청을 통틀어 동시에 진행할 웹 검색 수 (검색 엔진 rate limit에 맞게 조정)
+        search_concurrency: int = Field(default=8)
 
 
     async def emit_status(
@@ -113,6 +204,21 @@ class Filter:
         
     def __init__(self):
         self.valves = self.Valves()
+        self._semaphores = {}
+
+    def _get_semaphore(self, name: str, limit: int) -> asyncio.Semaphore:
+        """이름별로 공유하는 세마포어를 반환 (밸브 값이 바뀌면 새로 만듦)"""
+        limit = max(1, limit)
+        cached = self._semaphores.get(name)
+        if cached is None or cached[0] != limit:
+            cached = (limit, asyncio.Semaphore(limit))
+            self._semaphores[name] = cached
+        return cached[1]
+
+    async def _web_search(self, request: Any, query: str) -> SearchResult:
+        """동시 검색 수 제한 안에서 웹 검색"""
+        async with self._get_semaphore("search", self.valves.search_concurrency):
+            return await web_search(request, query)
 
     async def inlet(
         self,
@@ -122,14 +228,24 @@ class Filter:
         __user__: Optional[dict] = None,
         __model__: Optional[dict] = None,
     ) -> dict:
+        # 이번 요청 안에서 같은 검색어는 한 번만 검색한다 (사전 검색과 스탭 검색이 결과를 공유)
+        search_tasks: Dict[str, asyncio.Future] = {}
+        
         try:
 
             
-            user = Users.get_user_by_id(__user__["id"]) if __user__ else None
+            user = get_user_cached(__user__["id"], self.valves.user_cache_ttl) if __user__ else None
 
             messages = body["messages"]
             user_message = get_last_user_message(messages)
 
+            def cached_web_search(query: str) -> asyncio.Future:
+                key = query.strip().lower()
+                task = search_tasks.get(key)
+                if task is None:
+                    task = search_tasks[key] = asyncio.ensure_future(self._web_search(__request__, query))
+                return task
+
             # 사용자 질문 분석 →
 
             analysis_prompt = [
@@ -170,36 +286,47 @@ class Filter:
 
             websearch_keywords = analysis_obj.get("preliminary_search_keywords", [])
 
-            # 웹 검색 결과를 저장할 리스트
-            search_results = []
-            
-            # 각 키워드에 대한 웹 검색 수행 및 결과 저장
-            for keyword in websearch_keywords:
-                await self.emit_status(
-                    __event_emitter__,
-                    level="status",
-                    message=f"키워드 '{keyword}'에 대한 웹 검색 중...",
-                    done=False,
-                )
-                web_search_result = await web_search(__request__, keyword)
-                search_results.append(web_search_result)
+            # 각 키워드에 대한 웹 검색을 동시에 수행 (전체 시간은 가장 느린 검색 하나 수준)
+            await self.emit_status(
+                __event_emitter__,
+                level="status",
+                message=f"키워드 {len(websearch_keywords)}개에 대한 웹 검색 중...",
+                done=False,
+            )
+            search_results = await asyncio.gather(
+                *(cached_web_search(keyword) for keyword in websearch_keywords),
+                return_exceptions=True,
+            )
+            # 실패한 검색은 제외
+            search_results = [r for r in search_results if isinstance(r, dict)]
                 
-            # 검색 결과 취합
+            # 검색 결과 취합 (URL은 취합하면서 바로 중복 제거)
             combined_docs = []
             combined_urls = []
+            seen_urls = set()
             
             for result in search_results:
                 if "docs" in result:
                     combined_docs.extend(result.get("docs", []))
-                if "urls" in result:
-                    combined_urls.extend(result.get("urls", []))
-                    
-            # 중복 URL 제거
-            combined_urls = list(dict.fromkeys(combined_urls))
+                for url in result.get("urls", ()):
+                    if url not in seen_urls:
+                        seen_urls.add(url)
+                        combined_urls.append(url)
+            
+            # 계획에는 문서 전체 대신 제목, 출처와 앞부분 요약만 전달한다
+            snippet_chars = self.valves.plan_doc_snippet_chars
+            trimmed_docs = [
+                {
+                    "title": (doc.get("metadata") or {}).get("title", ""),
+                    "source": (doc.get("metadata") or {}).get("source", ""),
+                    "snippet": doc.get("content", "")[:snippet_chars],
+                }
+                for doc in combined_docs[:self.valves.plan_max_docs]
+            ]
             
             # 취합된 검색 결과
             combined_search_result = {
-                "docs": combined_docs,
+                "docs": trimmed_docs,
                 "urls": combined_urls,
                 "keywords": websearch_keywords,
                 "type": "combined_web_search"
@@ -243,11 +370,11 @@ class Filter:
                 {"role": "user", "content": f"""
                 사용자 질문: {user_message}
                 
-                초기 분석 결과: {json.dumps(analysis_obj, ensure_ascii=False)}
+                초기 분석 결과: {_json_dumps(analysis_obj)}
                 
                 초기 웹 검색 키워드: {websearch_keywords}
 
-                초기 웹 검색 결과: {json.dumps(combined_search_result, ensure_ascii=False)}
+                초기 웹 검색 결과: {_json_dumps(combined_search_result)}
                 
                 검색된 URL 수: {len(combined_urls)}
                 검색된 문서 수: {len(combined_docs)}
@@ -294,9 +421,8 @@ class Filter:
             print("################################################ 연구 계획 끝 #########################################")
 
             # 연구 계획 스탭 별 상세 검색 및 개별 보고서 생성
-            step_reports = []  # 각 스탭별 보고서를 저장할 리스트
-            
-            for step in research_plan.get("research_steps", []):
+            # 스탭끼리는 서로의 결과를 쓰지 않으므로 모든 스탭을 동시에 진행한다
+            async def collect_step_context(step: dict) -> dict:
                 step_number = step.get("step", "N/A")
                 step_description = step.get("description", "")
                 step_search_queries = step.get("search_queries", [])
@@ -309,33 +435,52 @@ class Filter:
                     done=False,
                 )
                 
-                # 각 스탭의 검색 결과 취합
+                await self.emit_status(
+                    __event_emitter__,
+                    level="status",
+                    message=f"스탭 {step_number}: 키워드 {len(step_search_queries)}개 웹 검색 중...",
+                    done=False,
+                )
+                step_search_results = await asyncio.gather(
+                    *(cached_web_search(query) for query in step_search_queries),
+                    return_exceptions=True,
+                )
+                
+                # 각 스탭의 검색 결과 취합 (URL은 취합하면서 바로 중복 제거)
                 step_combined_docs = []
                 step_combined_urls = []
-                for query in step_search_queries:
-                    await self.emit_status(
-                        __event_emitter__,
-                        level="status",
-                        message=f"스탭 {step_number}: 키워드 '{query}' 웹 검색 중...",
-                        done=False,
-                    )
-                    search_result = await web_search(__request__, query)
-                    if search_result:
+                step_seen_urls = set()
+                for search_result in step_search_results:
+                    if isinstance(search_result, dict):
                         if "docs" in search_result:
                             step_combined_docs.extend(search_result.get("docs", []))
-                        if "urls" in search_result:
-                            step_combined_urls.extend(search_result.get("urls", []))
-                
-                # 중복 URL 제거
-                step_combined_urls = list(dict.fromkeys(step_combined_urls))
+                        for url in search_result.get("urls", ()):
+                            if url not in step_seen_urls:
+                                step_seen_urls.add(url)
+                                step_combined_urls.append(url)
                 
                 # 검색 결과의 요약 텍스트 생성 (docs의 content를 간단히 결합)
-                combined_search_text = ""
-                for doc in step_combined_docs:
-                    combined_search_text += doc.get("content", "") + "\n"
+                combined_search_text = "".join(doc.get("content", "") + "\n" for doc in step_combined_docs)
                 if step_combined_urls:
                     combined_search_text += "\n관련 URL: " + ", ".join(step_combined_urls)
                 
+                # 스탭 보고서 프롬프트에 들어갈 스탭 정보와 검색 결과
+                return {
+                    "step": step_number,
+                    "context": f"""
+연구 단계: {step_number}
+단계 설명: {step_description}
+검색 키워드: {step_search_queries}
+예상 결과: {step_expected_outcomes}
+
+[검색 결과 요약]
+{combined_search_text}
+                        """,
+                }
+            
+            async def write_step_report(step_context: dict) -> dict:
+                step_number = step_context["step"]
+                
                 # 스탭별 보고서 생성을 위한 프롬프트 구성
                 step_prompt = [
                     {
@@ -347,15 +492,7 @@ class Filter:
                     },
                     {
                         "role": "user",
-                        "content": f"""
-연구 단계: {step_number}
-단계 설명: {step_description}
-검색 키워드: {step_search_queries}
-예상 결과: {step_expected_outcomes}
-
-[검색 결과 요약]
-{combined_search_text}
-                        """
+                        "content": step_context["context"],
                     }
                 ]
                 
@@ -379,24 +516,99 @@ class Filter:
                 
                 step_report_content = step_report_response.get("choices", [{}])[0].get("message", {}).get("content", "")
                 
-                # 개별 스탭 보고서 저장
-                step_reports.append({
+                await self.emit_status(
+                    __event_emitter__,
+                    level="status",
+                    message=f"연구 계획 스탭 {step_number} 보고서 작성 완료",
+                    done=True,
+                )
+                
+                # 개별 스탭 보고서 반환
+                return {
                     "step": step_number,
                     "report": step_report_content,
-                })
+                }
+            
+            async def process_step(step: dict) -> dict:
+                return await write_step_report(await collect_step_context(step))
+            
+            # 모든 스탭의 보고서를 한 번의 요청으로 작성 (형식이 맞지 않으면 스탭별 요청으로 대체)
+            async def write_step_reports_batched(step_contexts: list) -> list:
+                await self.emit_status(
+                    __event_emitter__,
+                    level="status",
+                    message=f"연구 계획 스탭 {len(step_contexts)}개의 보고서를 한 번에 작성 중...",
+                    done=False,
+                )
+                
+                batch_prompt = [
+                    {
+                        "role": "system",
+                        "content": """
+                당신은 조사 보고서를 작성하는 전문가입니다. 아래에 여러 연구 단계의 정보와 검색 결과가 있습니다.
+                각 연구 단계마다 상세 보고서를 작성하여 다음 JSON 형식으로 반환해주세요:
+                
+                {
+                    "step_reports": [
+                        {"step": 1, "report": "1단계 보고서"},
+                        ...
+                    ]
+                }
+                
+                step_reports는 입력된 연구 단계와 같은 순서, 같은 개수여야 합니다.
+                """
+                    },
+                    {
+                        "role": "user",
+                        "content": "\n\n".join(step_context["context"] for step_context in step_contexts),
+                    }
+                ]
+                
+                batch_response = await generate_chat_completion(
+                    request=__request__,
+                    form_data={
+                        "model": "o3-mini",
+                        "messages": batch_prompt,
+                        "stream": False,
+                    },
+                    user=user,
+                )
+                
+                batch_content = batch_response.get("choices", [{}])[0].get("message", {}).get("content", "")
+                batch_reports = extract_json_from_markdown(batch_content).get("step_reports")
+                
+                if (
+                    not isinstance(batch_reports, list)
+                    or len(batch_reports) != len(step_contexts)
+                    or not all(isinstance(report, dict) for report in batch_reports)
+                ):
+                    print("스탭 보고서 일괄 작성 결과 형식이 올바르지 않아 스탭별로 다시 작성합니다.")
+                    return await gather_or_cancel(*(write_step_report(step_context) for step_context in step_contexts))
                 
                 await self.emit_status(
                     __event_emitter__,
                     level="status",
-                    message=f"연구 계획 스탭 {step_number} 보고서 작성 완료",
+                    message=f"연구 계획 스탭 {len(step_contexts)}개 보고서 작성 완료",
                     done=True,
                 )
+                
+                return [
+                    {"step": step_context["step"], "report": report.get("report", "")}
+                    for step_context, report in zip(step_contexts, batch_reports)
+                ]
             
+            # 각 스탭별 보고서를 저장할 리스트 (계획의 스탭 순서 유지, 한 스탭이 실패하면 나머지 스탭도 취소)
+            research_steps = research_plan.get("research_steps", [])
+            if self.valves.batch_steps and research_steps:
+                step_contexts = await gather_or_cancel(*(collect_step_context(step) for step in research_steps))
+                step_reports = await write_step_reports_batched(step_contexts)
+            else:
+                step_reports = await gather_or_cancel(*(process_step(step) for step in research_steps))
             
             # 모든 스탭의 개별 보고서가 생성된 후 최종 종합 보고서 요청 프롬프트 생성
-            combined_step_reports_text = ""
-            for step_report in step_reports:
-                combined_step_reports_text += f"연구 단계 {step_report['step']} 보고서:\n{step_report['report']}\n\n"
+            combined_step_reports_text = "".join(
+                f"연구 단계 {step_report['step']} 보고서:\n{step_report['report']}\n\n" for step_report in step_reports
+            )
             
             final_report_prompt = [
                 {
@@ -412,7 +624,7 @@ class Filter:
                     "content": f"""
 사용자의 최초 질문: {user_message}
 
-연구 계획 개요: {json.dumps(research_plan, ensure_ascii=False, indent=2)}
+연구 계획 개요: {_json_dumps(research_plan, indent=True)}
 
 각 연구 단계별 보고서:
 {combined_step_reports_text}
@@ -438,15 +650,14 @@ class Filter:
        
         except Exception as e:
             print(f"오류 발생: {str(e)}")
-            print(f"오류 상세 정보:")
-            print(f"오류 유형: {type(e).__name__}")
-            print(f"오류 발생 위치: {e.__traceback__.tb_frame.f_code.co_filename}:{e.__traceback__.tb_lineno}")
-            print(f"오류 상세 메시지: {str(e)}")
             
-            # 스택 트레이스 출력
-            import traceback
-            print("스택 트레이스:")
-            print(''.join(traceback.format_tb(e.__traceback__)))
+            # 스택 트레이스 출력 (오류 유형, 위치, 메시지 포함)
+            print(traceback.format_exc())
+            
+        finally:
+            # 중간에 실패하거나 취소되면 아직 끝나지 않은 검색도 멈춘다
+            for task in search_tasks.values():
+                task.cancel()
             
         return body
 
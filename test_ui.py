@@ -5,7 +5,59 @@ UI 테스트 스크립트 - 스트리밍 검색 기능 테스트
 
 import asyncio
 import time
-from playwright.async_api import async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, async_playwright
+
+# 각 확인 항목은 (이름, 성공 여부, 부가 정보)를 반환하며, 클릭 직후부터 동시에 기다린다
+async def wait_status(page):
+    """상태 메시지 확인 (10초)"""
+    try:
+        await page.wait_for_selector(".status-message", state="attached", timeout=10_000)
+        return "status", True, await page.text_content(".status-message")
+    except PlaywrightTimeoutError:
+        return "status", False, None
+
+
+async def wait_decomposed(page):
+    """검색 쿼리 분해 확인 (20초)"""
+    try:
+        await page.wait_for_selector(".decomposed-queries", state="attached", timeout=20_000)
+        return "decomposed", True, None
+    except PlaywrightTimeoutError:
+        return "decomposed", False, None
+
+
+async def wait_report(page):
+    """보고서 생성 확인 (120초, 브라우저 안에서 보고서 내용이 채워질 때까지 기다림)"""
+    try:
+        await page.wait_for_function(
+            """() => {
+                const content = document.querySelector("#report")?.textContent || "";
+                return content.length > 50 && !content.includes("Generating report...");
+            }""",
+            timeout=120_000,
+        )
+        return "report", True, await page.text_content("#report")
+    except PlaywrightTimeoutError:
+        return "report", False, ""
+
+
+async def wait_steps(page):
+    """검색 단계 확인 (보고서와 같은 120초, 예전에는 보고서 대기 뒤에 확인했음)"""
+    try:
+        await page.wait_for_selector(".step", state="attached", timeout=120_000)
+        return "steps", True, len(await page.query_selector_all(".step"))
+    except PlaywrightTimeoutError:
+        return "steps", False, 0
+
+
+async def wait_sources(page):
+    """소스 확인 (보고서와 같은 120초, 예전에는 보고서 대기 뒤에 확인했음)"""
+    try:
+        await page.wait_for_selector("#sources-list li", state="attached", timeout=120_000)
+        return "sources", True, len(await page.query_selector_all("#sources-list li"))
+    except PlaywrightTimeoutError:
+        return "sources", False, 0
+
 
 async def test_streaming_search():
     """스트리밍 검색 기능을 테스트합니다."""
@@ -31,75 +83,47 @@ async def test_streaming_search():
         # 스트리밍 응답 확인
         print("스트리밍 응답 확인 중...")
 
-        # 상태 메시지 확인
-        status_visible = False
-        for _ in range(10):  # 10초 동안 확인
-            if await page.query_selector(".status-message") is not None:
-                status_visible = True
-                status_text = await page.text_content(".status-message")
-                print(f"상태 메시지 확인: {status_text}")
-                break
-            await asyncio.sleep(1)
-
+        # 다섯 항목은 서로 독립적이므로 동시에 기다린다 (전체 대기 시간은 가장 긴 항목 수준)
+        waiters = (wait_status, wait_decomposed, wait_report, wait_steps, wait_sources)
+        gathered = await asyncio.gather(*(waiter(page) for waiter in waiters), return_exceptions=True)
+        results = {}
+        for waiter, result in zip(waiters, gathered):
+            if isinstance(result, BaseException):
+                print(f"❌ {waiter.__name__} 확인 중 오류 발생: {result}")
+                continue
+            name, ok, payload = result
+            results[name] = (ok, payload)
+
+        status_visible, status_text = results.get("status", (False, None))
         if not status_visible:
             print("❌ 상태 메시지가 표시되지 않았습니다.")
         else:
+            print(f"상태 메시지 확인: {status_text}")
             print("✅ 상태 메시지가 표시되었습니다.")
 
-        # 검색 쿼리 분해 확인
-        decomposed_visible = False
-        for _ in range(20):  # 20초 동안 확인
-            if await page.query_selector(".decomposed-queries") is not None:
-                decomposed_visible = True
-                print("✅ 검색 쿼리 분해가 표시되었습니다.")
-                break
-            await asyncio.sleep(1)
-
-        if not decomposed_visible:
+        decomposed_visible, _ = results.get("decomposed", (False, None))
+        if decomposed_visible:
+            print("✅ 검색 쿼리 분해가 표시되었습니다.")
+        else:
             print("❌ 검색 쿼리 분해가 표시되지 않았습니다.")
 
-        # 보고서 생성 확인
-        report_content = ""
-        for _ in range(120):  # 120초 동안 확인
-            report_element = await page.query_selector("#report")
-            if report_element:
-                content = await report_element.text_content()
-                if content and "Generating report..." not in content and len(content) > 50:
-                    report_content = content
-                    print("✅ 보고서가 생성되었습니다.")
-                    print(f"보고서 내용 일부: {content[:100]}...")
-                    break
-            print(f"보고서 대기 중... ({_+1}/120초)")
-            await asyncio.sleep(1)
-
-        if not report_content:
+        _, report_content = results.get("report", (False, ""))
+        if report_content:
+            print("✅ 보고서가 생성되었습니다.")
+            print(f"보고서 내용 일부: {report_content[:100]}...")
+        else:
             print("❌ 보고서가 생성되지 않았습니다.")
 
-        # 검색 단계 확인
-        steps_visible = False
-        for _ in range(10):  # 10초 동안 확인
-            if await page.query_selector(".step") is not None:
-                steps_visible = True
-                steps_count = len(await page.query_selector_all(".step"))
-                print(f"✅ 검색 단계가 표시되었습니다. (총 {steps_count}개)")
-                break
-            await asyncio.sleep(1)
-
-        if not steps_visible:
+        steps_visible, steps_count = results.get("steps", (False, 0))
+        if steps_visible:
+            print(f"✅ 검색 단계가 표시되었습니다. (총 {steps_count}개)")
+        else:
             print("❌ 검색 단계가 표시되지 않았습니다.")
 
-        # 소스 확인
-        sources_visible = False
-        for _ in range(30):  # 30초 동안 확인
-            if await page.query_selector("#sources-list li") is not None:
-                sources_visible = True
-                sources_count = len(await page.query_selector_all("#sources-list li"))
-                print(f"✅ 소스가 표시되었습니다. (총 {sources_count}개)")
-                break
-            print(f"소스 대기 중... ({_+1}/30초)")
-            await asyncio.sleep(1)
-
-        if not sources_visible:
+        sources_visible, sources_count = results.get("sources", (False, 0))
+        if sources_visible:
+            print(f"✅ 소스가 표시되었습니다. (총 {sources_count}개)")
+        else:
             print("❌ 소스가 표시되지 않았습니다.")
 
         # 스크린샷 저장